@@ -0,0 +1,181 @@
+import time
+import argparse
+import numpy as np
+from scipy.spatial import distance as scipydist
+
+
+class GramRDM:
+    '''
+    Computes RDMs of several distance metrics from one Gram matrix.
+
+    Matrix product X * X^T of the [nstim x nfeatures] representation is done by the multithreaded BLAS numpy is linked
+    against (set the number of threads with OMP_NUM_THREADS / MKL_NUM_THREADS) and is computed only once, all of the
+    supported metrics are derived from it and from the row norms at the cost of a few [nstim x nstim] operations.
+
+    For representations that do not fit into memory the Gram matrix and the row sums are accumulated over chunks of
+    features, see chunk_size().
+    '''
+
+    #: Distance metrics that can be derived from the Gram matrix
+    METRICS = ['euclidean', 'sqeuclidean', 'cosine', 'correlation']
+
+    #: [nstim x nstim] Gram matrix of the representation
+    gram = None
+
+    #: Sum of the features of each of the stimuli, needed to center the Gram matrix for correlation distance
+    sums = None
+
+    #: Number of features
+    nfeatures = None
+
+    #: Floating point type the Gram matrix is computed in
+    dtype = np.float64
+
+    def __init__(self, representation, rows=None, chunk=None, dtype=np.float64):
+        '''
+        @param representation: [n x nfeatures] array or path to an .npy file with it, the file is then read chunk by
+                               chunk with read_block()
+        @param rows:           indices of the rows (stimuli) to use in that order, None to use all rows
+        @param chunk:          number of features to process at once, None to process all of them at once
+        @param dtype:          np.float64 or np.float32
+        '''
+        self.dtype = dtype
+        if chunk is None and not isinstance(representation, str):
+            representation = np.asarray(representation, dtype=dtype)
+            if rows is not None:
+                representation = representation[rows]
+            self.gram = np.dot(representation, representation.T)
+            self.sums = np.sum(representation, axis=1)
+            self.nfeatures = representation.shape[1]
+            return
+
+        if isinstance(representation, str):
+            shape, _, _ = GramRDM.read_header(representation)
+        else:
+            shape = representation.shape
+        rows = np.arange(shape[0]) if rows is None else np.asarray(rows)
+        self.nfeatures = shape[1]
+        chunk = self.nfeatures if chunk is None else chunk
+
+        self.gram = np.zeros((len(rows), len(rows)), dtype=dtype)
+        self.sums = np.zeros(len(rows), dtype=dtype)
+        for start in range(0, self.nfeatures, chunk):
+            if isinstance(representation, str):
+                block = GramRDM.read_block(representation, rows, start, min(start + chunk, self.nfeatures))
+            else:
+                block = representation[:, start:start + chunk][rows]
+            block = np.asarray(block, dtype=dtype)
+            self.gram += np.dot(block, block.T)
+            self.sums += np.sum(block, axis=1)
+
+    @staticmethod
+    def read_header(filename):
+        '''
+        @return: (shape, dtype, offset of the data in the file) of an .npy file
+        '''
+        with open(filename, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if fortran_order or len(shape) != 2:
+                raise Exception('%s is not a C-ordered matrix' % filename)
+            return shape, dtype, f.tell()
+
+    @staticmethod
+    def read_block(filename, rows, start, stop):
+        '''
+        Read columns [start, stop) of the given rows of a matrix stored in an .npy file. Each row segment is read with a
+        positioned read, so only the block itself becomes resident. Pages of a memory map would stay mapped (in whole
+        folios, often much more than was asked for) and count towards the RSS limit of the job.
+        '''
+        shape, dtype, offset = GramRDM.read_header(filename)
+        block = np.empty((len(rows), stop - start), dtype=dtype)
+        with open(filename, 'rb') as f:
+            for i, row in enumerate(rows):
+                f.seek(offset + (int(row) * shape[1] + start) * dtype.itemsize)
+                block[i] = np.fromfile(f, dtype=dtype, count=stop - start)
+        return block
+
+    @staticmethod
+    def chunk_size(nrows, max_memory, itemsize=8, block_itemsize=None):
+        '''
+        Number of features per chunk so that the computation stays within the memory budget
+
+        @param nrows:          number of rows (stimuli) of the representation
+        @param max_memory:     memory budget in bytes
+        @param itemsize:       size of one value of the Gram matrix in bytes, 8 for float64 and 4 for float32
+        @param block_itemsize: size of one value of the representation as it is read (its dtype in the file), blocks
+                               are read in it and then cast to the Gram matrix type, None if it is the same as itemsize
+        '''
+        block_itemsize = itemsize if block_itemsize is None else block_itemsize
+        fixed = 4 * nrows * nrows * itemsize
+        per_feature = nrows * (block_itemsize + itemsize)
+        if max_memory <= fixed + per_feature:
+            raise Exception('Memory budget of %d bytes is too small, need at least %d' % (max_memory, fixed + per_feature))
+        return int((max_memory - fixed) / per_feature)
+
+    def dsm(self, distance):
+        '''
+        @param distance: one of GramRDM.METRICS
+        @return:         square RDM as scipy.spatial.distance.pdist would compute it for that metric
+        '''
+        if distance not in GramRDM.METRICS:
+            raise Exception('Distance %s cannot be computed from the Gram matrix' % distance)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if distance in ['euclidean', 'sqeuclidean']:
+                norms = np.diag(self.gram)
+                dsm = norms[:, np.newaxis] + norms[np.newaxis, :] - 2.0 * self.gram
+                np.maximum(dsm, 0.0, out=dsm)
+                if distance == 'euclidean':
+                    np.sqrt(dsm, out=dsm)
+
+            elif distance == 'cosine':
+                norms = np.sqrt(np.diag(self.gram))
+                dsm = 1.0 - self.gram / np.outer(norms, norms)
+
+            elif distance == 'correlation':
+                centered = self.gram - np.outer(self.sums, self.sums) / float(self.nfeatures)
+                norms = np.sqrt(np.diag(centered))
+                dsm = 1.0 - centered / np.outer(norms, norms)
+
+        np.fill_diagonal(dsm, 0.0)
+        return dsm
+
+    @staticmethod
+    def benchmark(representation, distances):
+        '''
+        Time pdist against the Gram matrix engine on the same representation and report the speedup and the largest
+        absolute difference between the resulting RDMs
+        '''
+        start = time.time()
+        engine = GramRDM(representation)
+        dsms = dict([(distance, engine.dsm(distance)) for distance in distances])
+        gram_time = time.time() - start
+
+        pdist_time = 0.0
+        for distance in distances:
+            start = time.time()
+            reference = scipydist.squareform(scipydist.pdist(representation, distance))
+            pdist_time += time.time() - start
+            print '%-12s max abs difference %.3e' % (distance, np.nanmax(np.abs(reference - dsms[distance])))
+
+        print 'pdist: %.3fs, Gram matrix: %.3fs, speedup %.1fx' % (pdist_time, gram_time, pdist_time / gram_time)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare speed of the Gram matrix RDM engine to scipy pdist')
+    parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='DNN activations for DNN RDMs')
+    parser.add_argument('-l', '--layer', dest='layer', type=str, required=True, help='The layer to benchmark on')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=False, default=','.join(GramRDM.METRICS), help='Comma-separated list of distance metrics')
+    args = parser.parse_args()
+    network = str(args.network)
+    layer = str(args.layer)
+    distances = str(args.distance).split(',')
+
+    representation = np.load('../../Code/DNN/activations/%s/%s/activations.npy' % (network, layer))
+    print 'Benchmarking on %s %s (%d x %d)' % (network, layer, representation.shape[0], representation.shape[1])
+    GramRDM.benchmark(representation, distances)
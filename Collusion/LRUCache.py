@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    In-memory cache of numpy arrays limited by the total number of bytes they take. When a new array does not fit,
+    the least recently used ones are dropped, an array larger than the whole limit is not kept at all.
+    '''
+
+    #: Limit on the total size of the cached arrays in bytes
+    max_bytes = None
+
+    #: Total size of the cached arrays in bytes
+    nbytes = 0
+
+    #: Statistics
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        '''
+        @return: the cached array or None if it is not in the cache
+        '''
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+        if value.nbytes > self.max_bytes:
+            return
+        while self.nbytes + value.nbytes > self.max_bytes:
+            _, dropped = self.entries.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+        self.entries[key] = value
+        self.nbytes += value.nbytes
+
+    def __str__(self):
+        return '%d arrays, %.1f of %.1f MB, %d hits, %d misses' % (len(self.entries), self.nbytes / 1024.0 / 1024.0,
+                                                                  self.max_bytes / 1024.0 / 1024.0, self.hits, self.misses)
@@ -0,0 +1,163 @@
+import os
+import time
+import argparse
+import numpy as np
+from RDM import RDMPixel, RDMDNN
+from RSAScorer import RSAScorer
+from RankCorrelation import RankCorrelation
+
+
+class LayerSimilarity:
+    '''
+    Similarity of every pair of layers of any set of networks, pixel space included once:
+
+      spearman: Spearman correlation between layer RDMs, as RSAScorer.compute_one_correlation_score() computes it in the
+                matrix scope, every RDM is ranked once and all pairs are one matrix product (see RankCorrelation)
+      cka:      linear CKA between layer activations, computed from the Gram matrices of the activations (kept in the
+                RDM cache), all pairs are one matrix product of the normalized centered Gram matrices
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    OUTDIR = '%s/RSA/LayerSimilarity' % DATADIR
+
+    #: Similarity measures that can be computed
+    METHODS = ['spearman', 'cka']
+
+    #: Parameters
+    distance = None
+    networks = None
+    featureset = None
+    dtype = np.float64
+
+    #: (network, layer) of each of the rows and columns of the results, pixel space has no network
+    labels = None
+
+    #: Results: method -> [nlabels x nlabels] matrix, p-values of the Spearman correlations
+    similarity = None
+    pvalues = None
+
+    def __init__(self, distance, networks, layers=None, featureset='', dtype=np.float64):
+        '''
+        @param networks:   list of networks
+        @param layers:     list of layers (out of RSAScorer.layers) to use, None for all of them
+        @param featureset: any featureset, layer RDMs do not depend on it
+        '''
+        self.distance = distance
+        self.networks = networks
+        self.featureset = featureset
+        self.dtype = dtype
+        layers = RSAScorer.layers if layers is None else [layer for layer in RSAScorer.layers if layer in layers]
+        self.labels = [('', layer) for layer in layers if layer == 'pixels']
+        self.labels += [(network, layer) for network in networks for layer in layers if layer != 'pixels']
+        self.similarity = {}
+
+    def label(self, i):
+        network, layer = self.labels[i]
+        return layer if network == '' else '%s/%s' % (network, layer)
+
+    def pixel_rdm(self):
+        return RDMPixel(self.distance, self.featureset, shuffle=False, load_representation=False, dtype=self.dtype)
+
+    def network_rdm(self, network):
+        return RDMDNN(self.distance, network, self.featureset, shuffle=False, load_representation=False, dtype=self.dtype)
+
+    def load_dsms(self):
+        '''
+        @return: [nlabels x nstim x nstim] layer RDMs
+        '''
+        dsms = []
+        for network, layer in self.labels:
+            if network == '':
+                rdm = self.pixel_rdm()
+                rdm.load_dsm()
+                dsms.append(rdm.dsm)
+        for network in self.networks:
+            rdm = self.network_rdm(network)
+            rdm.load_dsm()
+            dsms += [rdm.dsm[layer] for n, layer in self.labels if n == network]
+        return np.array(dsms, dtype=self.dtype)
+
+    def load_grams(self):
+        '''
+        @return: [nlabels x nstim x nstim] Gram matrices of the activations, computed and cached if they are missing
+        '''
+        grams = []
+        for network, layer in self.labels:
+            if network == '':
+                grams.append(self.pixel_rdm().gram())
+        for network in self.networks:
+            rdm = self.network_rdm(network)
+            grams += [rdm.gram(layer) for n, layer in self.labels if n == network]
+        return np.array(grams, dtype=self.dtype)
+
+    def compute_spearman(self):
+        ranks = RankCorrelation.ranked_matrices(self.load_dsms())
+        self.similarity['spearman'] = np.dot(ranks, ranks.T)
+        self.pvalues = RankCorrelation.pvalues(self.similarity['spearman'], ranks.shape[1])
+        return self.similarity['spearman']
+
+    @staticmethod
+    def cka(grams):
+        '''
+        @param grams: [n x nstim x nstim] Gram matrices
+        @return:      [n x n] linear CKA between each pair of the representations
+        '''
+        grams = np.array(grams, dtype=np.float64)
+
+        # centering the features is centering both rows and columns of the Gram matrix
+        grams -= np.mean(grams, axis=1)[:, np.newaxis, :]
+        grams -= np.mean(grams, axis=2)[:, :, np.newaxis]
+        flat = grams.reshape((len(grams), -1))
+        flat /= np.sqrt(np.sum(flat ** 2, axis=1))[:, np.newaxis]
+        return np.dot(flat, flat.T)
+
+    def compute_cka(self):
+        self.similarity['cka'] = LayerSimilarity.cka(self.load_grams())
+        return self.similarity['cka']
+
+    def compute(self, methods):
+        for method in methods:
+            if method == 'spearman':
+                self.compute_spearman()
+            elif method == 'cka':
+                self.compute_cka()
+            else:
+                raise Exception('Unknown similarity measure %s' % method)
+
+    def store(self, filename=None):
+        '''
+        @param filename: where to store the results, by default a file named by the distance and the networks in OUTDIR
+        @return:         the file name
+        '''
+        if filename is None:
+            try:
+                os.makedirs(self.OUTDIR)
+            except:
+                pass
+            filename = '%s/%s.%s.npz' % (self.OUTDIR, self.distance, '+'.join(self.networks))
+        results = dict(self.similarity)
+        if self.pvalues is not None:
+            results['pvalues'] = self.pvalues
+        np.savez(filename, labels=[self.label(i) for i in range(len(self.labels))], **results)
+        return filename
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute similarity between all layers of several networks')
+    parser.add_argument('-n', '--networks', dest='networks', type=str, required=True, help='Comma-separated list of networks')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric of layer RDMs (for spearman)')
+    parser.add_argument('-l', '--layers', dest='layers', type=str, required=False, help='Comma-separated list of layers, all of them by default')
+    parser.add_argument('-s', '--similarity', dest='similarity', type=str, required=False, default='spearman,cka', help='Comma-separated list of similarity measures: spearman, cka')
+    parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=False, default='', help='Any featureset, layer RDMs do not depend on it')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type of RDMs and Gram matrices: float64 or float32')
+    args = parser.parse_args()
+    layers = str(args.layers).split(',') if args.layers is not None else None
+
+    start = time.time()
+    layersimilarity = LayerSimilarity(str(args.distance), str(args.networks).split(','), layers, str(args.featureset),
+                                      np.dtype(str(args.precision)).type)
+    layersimilarity.compute(str(args.similarity).split(','))
+    print '%d layers compared in %.2fs, results in %s' % (len(layersimilarity.labels), time.time() - start,
+                                                         layersimilarity.store())
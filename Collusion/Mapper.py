@@ -4,7 +4,9 @@ import cPickle
 import numpy as np
 import scipy.io as sio
 import random
+import multiprocessing
 from Plotter import Plotter
+from PopulationRDM import PopulationRDM
 from scipy.stats import spearmanr, kendalltau
 from scipy.stats import mannwhitneyu
 from IPython import embed
@@ -107,8 +109,17 @@ class Mapper:
             pvals[sname] = np.ones(scores[sname]['scores'].shape)
             for pid in range(len(areas)):
                 print 'Computing p-value for subject %s probe %d' % (sname, pid)
-                permutation_scores = np.genfromtxt('%s/%s-%d.txt' % (self.PERMDIR, sname, pid))
-                pvals[sname][pid] = np.sum(permutation_scores >= scores[sname]['scores'][pid], axis=0) / float(permutation_scores.shape[0])
+                permutation_scores = np.atleast_2d(np.genfromtxt('%s/%s-%d.txt' % (self.PERMDIR, sname, pid)))
+                nperm = float(permutation_scores.shape[0])
+
+                # the sequential test of RDMPermuter stops each layer after its own number of permutations
+                nperm_file = '%s/%s-%d.nperm.txt' % (self.PERMDIR, sname, pid)
+                if os.path.isfile(nperm_file):
+                    nperm = np.loadtxt(nperm_file).astype(float)
+                    if np.any(nperm > permutation_scores.shape[0]) or np.any(nperm < 1):
+                        raise Exception('%s does not match the %d permutation scores next to it, rerun RDMPermuter for '
+                                        'subject %s probe %d' % (nperm_file, permutation_scores.shape[0], sname, pid))
+                pvals[sname][pid] = np.sum(permutation_scores >= scores[sname]['scores'][pid], axis=0) / nperm
 
         # store computed p-values for future runs
         with open('%s_pvals.pkl' % self.PERMDIR, 'wb') as outfile:
@@ -499,6 +510,22 @@ class Mapper:
 
     
 
+    def compute_and_plot_area_population(self, workers=1):
+        '''
+        Instead of aggregating per-probe scores, pool the responses of all probes of an area across subjects into one
+        population RDM per area and score it against each layer, see PopulationRDM
+        '''
+        if self.backbone != 'rsa' or self.suffix != '':
+            raise Exception('Population RDMs are computed for the rsa backbone on unmasked responses only')
+
+        population = PopulationRDM(self.featureset, self.distance, self.network, self.scope, self.threshold)
+        score_per_arealayer = population.compute_scores(workers)
+        n_per_area = population.nprobes.astype(np.float64)
+
+        filename = 'population_%s_%s.%s.%s.%s%s' % (self.backbone, self.featureset, self.distance, self.network, self.scope, ('%.10f' % self.threshold)[2:].rstrip('0'))
+        np.save('%s/Statistics/%s.npy' % (self.OUTDIR, filename), {'scores': score_per_arealayer, 'nprobes': population.nprobes})
+        Plotter.xlayer_yarea_zscore('%s/Mapper/%s.png' % (self.OUTDIR, filename), self.nareas, self.nlayers, n_per_area, n_per_area, score_per_arealayer, 'Area population RDMs')
+
     def compute_and_plot_single_mni_score(self, filter_by_permutation=False):
 
         # load the correlation scores
@@ -542,8 +569,10 @@ if __name__ == '__main__':
     parser.add_argument('-t', '--threshold', dest='threshold', type=float, required=False, help='Significance level a score must have to be counter (1.0 to store all)')
     parser.add_argument('-s', '--statistic', dest='statistic', type=str, required=True, help='Type of score to compute when aggregating: varexp, corr')
     parser.add_argument('-p', '--permfilter', dest='permfilter', type=str, required=True, help='Whether to filter the results with permutation test results')
-    parser.add_argument('-g', '--graph', dest='graph', type=str, required=True, help='Which graph to output: layer_area_score, mni_score, mni_layer')
+    parser.add_argument('-g', '--graph', dest='graph', type=str, required=True, help='Which graph to output: layer_area_score, mni_score, mni_layer, area_population')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, required=False, default=multiprocessing.cpu_count(), help='Number of worker processes for area_population')
     parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Activations of which DNN are used')
+    parser.add_argument('--masked', dest='masked', type=str, required=False, default=False, help='Whether to map the scores computed on masked brain RDMs')
     args = parser.parse_args()
 
     # check conditional requirements
@@ -558,10 +587,11 @@ if __name__ == '__main__':
     onwhat = str(args.onwhat)
     threshold = float(args.threshold) if args.threshold is not None else None
     statistic = str(args.statistic)
-    suffix = ''
+    suffix = '.masked' if args.masked == 'True' else ''
     permfilter = bool(args.permfilter == 'True')
     graph = str(args.graph)
     network = str(args.network)
+    workers = int(args.workers)
 
     # initialize and run the mapper
     mapper = Mapper(backbone, featureset, distance, suffix, onwhat, threshold, statistic, network)
@@ -582,6 +612,9 @@ if __name__ == '__main__':
     
     elif graph == 'mni_layer':
         mapper.compute_and_plot_single_mni_layer(permfilter)
+
+    elif graph == 'area_population':
+        mapper.compute_and_plot_area_population(workers)
     
     else:
         raise Exception('Unknown graph %s' % graph)
@@ -0,0 +1,112 @@
+import time
+import multiprocessing
+import numpy as np
+from scipy.spatial import distance as scipydist
+from RDM import RDMBrain
+from RSAScorer import RSAScorer
+from RankCorrelation import RankCorrelation
+
+
+class PopulationRDM:
+    '''
+    Population RDMs of brain areas: responses of all of the probes in an area, pooled across subjects (stimuli are
+    in the same category order for all of them), form one response vector per stimulus and the RDM of these vectors
+    is scored against each layer. Unlike probe RDMs, which are distances between scalars, population RDMs are
+    computed with the same distance metric as the layer RDMs.
+
+    Areas are scored in parallel by a pool of processes that inherit the responses and the ranked layer RDMs.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+
+    #: Number of Brodmann areas, as in Mapper
+    nareas = 49
+
+    #: Paramters to compute on
+    featureset = None
+    distance = None
+    network = None
+    scope = None
+    threshold = None
+    dtype = np.float64
+
+    #: Responses of all of the probes of all of the subjects, [nstim x nprobes] in category order
+    responses = None
+
+    #: Area of each of the probes
+    areas = None
+
+    #: RDMs on DNN layers, [nlayers x nstim x nstim]
+    dnn_dsms = None
+
+    #: Results: [nareas x nlayers] scores and the number of probes in each of the areas
+    scores = None
+    nprobes = None
+
+    def __init__(self, featureset, distance, network, scope, threshold, dtype=np.float64):
+        self.featureset = featureset
+        self.distance = distance
+        self.network = network
+        self.scope = scope
+        self.threshold = threshold
+        self.dtype = dtype
+        self.load_probes()
+        self.dnn_dsms = RSAScorer.read_layer_dsms(distance, featureset, network, dtype)
+
+    def load_probes(self):
+        '''
+        Collect responses and areas of the probes of all of the subjects
+        '''
+        pooled = RDMBrain.pool_subjects(self.distance, self.featureset, self.dtype)
+        self.responses = pooled['responses']
+        self.areas = pooled['areas']
+        self.nprobes = np.bincount(self.areas, minlength=self.nareas)[:self.nareas]
+
+    def compute_dsm(self, aid):
+        '''
+        @return: [nstim x nstim] RDM of the responses of all of the probes in the area, one pdist over the stimuli
+        '''
+        return scipydist.squareform(scipydist.pdist(self.responses[:, self.areas == aid], self.distance))
+
+    def compute_scores(self, workers=1):
+        '''
+        Score population RDMs of all of the areas that have probes against each layer
+
+        @param workers: number of worker processes, each of them scores one area at a time
+        @return:        [nareas x nlayers] scores, 0 for areas without probes
+        '''
+        start = time.time()
+        aids = [aid for aid in range(self.nareas) if self.nprobes[aid] > 0]
+
+        # workers are forked after the data is in place and inherit it instead of receiving a copy
+        population_data.update({'population': self, 'layer_ranks': RankCorrelation.ranked(self.dnn_dsms, self.scope)})
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            area_scores = pool.map(compute_area_scores, aids)
+            pool.close()
+            pool.join()
+        else:
+            area_scores = map(compute_area_scores, aids)
+        population_data.clear()
+
+        self.scores = np.zeros((self.nareas, len(self.dnn_dsms)), dtype=self.dtype)
+        self.scores[aids] = area_scores
+        self.scores[np.isnan(self.scores)] = 0.0
+        print 'Population RDMs of %d areas (%d probes) scored in %.2fs with %d workers' % (len(aids), len(self.areas),
+                                                                                       time.time() - start, workers)
+        return self.scores
+
+
+#: Population and ranked layer RDMs the workers score against, set before the pool of workers is created
+population_data = {}
+
+
+def compute_area_scores(aid):
+    '''
+    Worker of PopulationRDM.compute_scores(): score the population RDM of one area against each layer
+    '''
+    population = population_data['population']
+    brain_ranks = RankCorrelation.ranked(population.compute_dsm(aid)[np.newaxis], population.scope)
+    return RankCorrelation.ranked_scores(population_data['layer_ranks'], brain_ranks, population.threshold,
+                                         population.scope)[0]
@@ -0,0 +1,129 @@
+import os
+import time
+import resource
+import argparse
+import numpy as np
+from RDM import RDMBrain
+from RankCorrelation import RankCorrelation
+
+
+class ProbeSimilarity:
+    '''
+    Spearman similarity between the RDMs of every pair of probes of all of the subjects of a featureset, for
+    clustering and connectivity-style analyses.
+
+    Each probe RDM is built in condensed form (the upper triangle) and ranked once, the standardized ranks go to a
+    memory-mapped file and the probe x probe matrix is computed from them with products of tiles of rows, written
+    tile by tile into a memory-mapped output. Only two tiles of ranks and one tile of the output are in memory at a
+    time, so the number of probes is bounded by disk rather than memory.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    OUTDIR = None
+
+    #: Paramters to compute on
+    featureset = None
+    distance = None
+    dtype = np.float64
+
+    #: Memory budget in bytes for the tiles
+    max_memory = None
+
+    #: Number of float64 arrays of the size of a tile of condensed RDMs that exist at once while a tile is built and
+    #: ranked: the two gathered responses and their difference, the sort order, sorted values, runs, averages, ranks and
+    #: the temporaries of standardizing them
+    RANK_ARRAYS = 10
+
+    #: Pooled probes of all of the subjects, see RDMBrain.pool_subjects()
+    probes = None
+
+    def __init__(self, featureset, distance, dtype=np.float64, max_memory=512 * 1024 * 1024):
+        self.featureset = featureset
+        self.distance = distance
+        self.dtype = dtype
+        self.max_memory = max_memory
+        self.probes = RDMBrain.pool_subjects(distance, featureset, dtype)
+
+        self.OUTDIR = '%s/Intracranial/Probe_Similarity/%s.%s' % (self.DATADIR, self.featureset, self.distance)
+        try:
+            os.makedirs(self.OUTDIR)
+        except:
+            pass
+
+    def tile_size(self, ncolumns):
+        '''
+        @return: number of rows in a tile so that two tiles of ranks and a tile of the output fit the memory budget
+        '''
+        itemsize = np.dtype(self.dtype).itemsize
+        return max(1, int(self.max_memory / (2 * ncolumns * itemsize + 8 * ncolumns)))
+
+    def rank_tile_size(self, ncolumns):
+        '''
+        @return: number of probes ranked at once so that all of the temporaries of ranking them fit the memory budget
+        '''
+        return max(1, int(self.max_memory / (self.RANK_ARRAYS * ncolumns * 8)))
+
+    def rank_probes(self):
+        '''
+        Rank the condensed RDMs of all of the probes into ranks.npy, probe RDMs of a tile are built with one broadcast
+
+        @return: read-only memory map of the [nprobes x npairs] standardized ranks, NaN rows for constant RDMs
+        '''
+        responses = self.probes['responses']
+        nstim, nprobes = responses.shape
+        upper = np.triu_indices(nstim, 1)
+        ranks = np.lib.format.open_memmap('%s/ranks.npy' % self.OUTDIR, mode='w+', dtype=self.dtype,
+                                          shape=(nprobes, len(upper[0])))
+        tile = self.rank_tile_size(len(upper[0]))
+        for first in range(0, nprobes, tile):
+            x = responses[:, first:first + tile].T
+            condensed = np.abs(x[:, upper[0]] - x[:, upper[1]])
+            ranks[first:first + tile] = RankCorrelation.standardize_rows(RankCorrelation.rank_rows(condensed))
+        ranks.flush()
+        del ranks
+        return np.load('%s/ranks.npy' % self.OUTDIR, mmap_mode='r')
+
+    def compute_similarity(self):
+        '''
+        Probe x probe matrix of Spearman correlations between probe RDMs, computed tile by tile into similarity.npy,
+        tiles below the diagonal are mirrored from the ones above it
+
+        @return: read-only memory map of the [nprobes x nprobes] matrix
+        '''
+        ranks = self.rank_probes()
+        nprobes = ranks.shape[0]
+        similarity = np.lib.format.open_memmap('%s/similarity.npy' % self.OUTDIR, mode='w+', dtype=self.dtype,
+                                               shape=(nprobes, nprobes))
+        tile = self.tile_size(ranks.shape[1])
+        for a in range(0, nprobes, tile):
+            rows = np.array(ranks[a:a + tile])
+            for b in range(a, nprobes, tile):
+                columns = rows if b == a else np.array(ranks[b:b + tile])
+                product = np.dot(rows, columns.T)
+                similarity[a:a + tile, b:b + tile] = product
+                similarity[b:b + tile, a:a + tile] = product.T
+        similarity.flush()
+        del similarity
+
+        np.savez('%s/probes.npz' % self.OUTDIR, subjects=self.probes['names'], pids=self.probes['pids'],
+                 areas=self.probes['areas'], mni=self.probes['mni'])
+        return np.load('%s/similarity.npy' % self.OUTDIR, mmap_mode='r')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute Spearman similarity between RDMs of all pairs of probes')
+    parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric of the RDM directory')
+    parser.add_argument('-m', '--max-memory', dest='maxmemory', type=int, required=False, default=512, help='Memory budget in MB for tiles of ranks and of the output')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type of the ranks and the output: float64 or float32')
+    args = parser.parse_args()
+
+    start = time.time()
+    probesimilarity = ProbeSimilarity(str(args.featureset), str(args.distance), np.dtype(str(args.precision)).type,
+                                      int(args.maxmemory) * 1024 * 1024)
+    similarity = probesimilarity.compute_similarity()
+    print '%d x %d probe similarity matrix in %s in %.2fs, peak RSS: %.1f MB' % (similarity.shape[0], similarity.shape[1],
+                                                                              probesimilarity.OUTDIR, time.time() - start,
+                                                                              resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
@@ -1,9 +1,17 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
 import os
+import time
+import resource
+import multiprocessing
 import numpy as np
 import scipy.io as sio
-from scipy.ndimage import imread
 from scipy.spatial import distance as scipydist
+from RDMStore import RDMStore
+from RDMCache import RDMCache
+from GramRDM import GramRDM
+from SketchRDM import SketchRDM
+from StimulusTensor import StimulusTensor
+from StimulusIndex import StimulusIndex
 import argparse
 
 
@@ -18,6 +26,17 @@ class RDM:
     #: The distance metric
     distance = None
 
+    #: How to compute the distances: 'pdist' (scipy) or 'gram' (see GramRDM)
+    backend = 'pdist'
+
+    #: Memory budget in bytes, if set the representation is not loaded into memory as a whole, instead distances are
+    #: accumulated over chunks of features (see GramRDM) and the rows to use are kept separately in self.rows
+    max_memory = None
+
+    #: Floating point type of representations and RDMs: np.float64 or np.float32 (half the memory and bandwidth),
+    #: float32 RDMs are cached apart from float64 ones
+    dtype = np.float64
+
     #: Flag whether to shuffle or not
     shuffle = None
 
@@ -36,29 +55,18 @@ class RDM:
     #: Reordering of the images from the order of stimulation into ordering by categories
     reorder_stimulation_to_categories = []
 
+    #: Stimulus lists and reorderings, computed once per process and shared by all instances (and by forked workers)
+    stimulus_orderings = None
+
     def __init__(self, distance, featureset, shuffle):
         self.distance = distance
         self.shuffle = shuffle
         self.featureset = featureset
 
-        # list of stimuli used for human stimulation
-        stimulation_stimuli = np.loadtxt('../Intracranial/stimsequence.txt', dtype='string')
-
-        # create the reordering from stimulation order to order by category
-        self.reorder_stimulation_to_categories = []
-        for s in sorted(set(stimulation_stimuli)):
-            for i in np.where(stimulation_stimuli == s)[0]:
-                self.reorder_stimulation_to_categories.append(i)
-
-        # list of stimuli used to extract DNN activations
-        self.dnn_stimuli = np.loadtxt('%s/DNN/imagesdone.txt' % self.DATADIR, dtype={'names': ('stimulus', 'class'), 'formats': ('S10', 'i1')})
-        self.dnn_stimuli = np.array([x[0].split('.')[0] for x in self.dnn_stimuli])
-
-        # create the reordering from dnn order to order by category
-        self.reorder_dnn_to_categories = []
-        for s in sorted(stimulation_stimuli):
-            for i in np.where(self.dnn_stimuli == s)[0]:
-                self.reorder_dnn_to_categories.append(i)
+        orderings = RDM.load_stimulus_orderings()
+        self.dnn_stimuli = orderings['dnn_stimuli']
+        self.reorder_stimulation_to_categories = orderings['reorder_stimulation_to_categories']
+        self.reorder_dnn_to_categories = orderings['reorder_dnn_to_categories']
 
         # create the directory to store results
         self.OUTDIR = '%s/RSA/%s.%s' % (self.DATADIR, self.featureset, self.distance)
@@ -70,6 +78,104 @@ class RDM:
             pass
         
 
+    @staticmethod
+    def load_stimulus_orderings():
+        '''
+        Stimulus lists and reorderings from the persisted stimulus index, see StimulusIndex
+        '''
+        if RDM.stimulus_orderings is None:
+            RDM.stimulus_orderings = StimulusIndex.load()
+        return RDM.stimulus_orderings
+
+    def cache_key(self, filenames, distance=None):
+        '''
+        Key of an RDM computed from the given files in the RDM cache, see RDMCache
+        '''
+        distance = self.distance if distance is None else distance
+        if self.dtype != np.float64:
+            distance = '%s~%s' % (distance, np.dtype(self.dtype).name)
+        return RDMCache.key(RDMCache.file_digest(filenames), distance, self.reorder_dnn_to_categories)
+
+    def load_cached_dsm(self, filenames, legacy, description):
+        '''
+        RDM of self.dtype from the RDM cache, the float64 entry is cast if there is none of that precision. RDMs that
+        are not in the cache are read from the featureset directory, where earlier versions stored them.
+
+        @param legacy:      path to the RDM in the featureset directory without the extension
+        @param description: what the RDM is, for the error message
+        '''
+        key = self.cache_key(filenames)
+        if RDMCache.exists(key):
+            return RDMCache.load(key)
+        if self.dtype != np.float64:
+            key = RDMCache.key(RDMCache.file_digest(filenames), self.distance, self.reorder_dnn_to_categories)
+            if RDMCache.exists(key):
+                return RDMCache.load(key).astype(self.dtype)
+        if not RDMStore.exists(legacy):
+            raise Exception('No %s RDM of %s distance in the RDM cache (neither %s nor float64) or in %s, compute it '
+                            'with RDM.py' % (description, self.distance, np.dtype(self.dtype).name, os.path.dirname(legacy)))
+        return RDMStore.load(legacy).astype(self.dtype, copy=False)
+
+    def gram_engine(self, representation, rows):
+        '''
+        Gram matrix of the representation, accumulated over chunks of features if the memory budget is set
+        '''
+        if self.max_memory is None:
+            return GramRDM(representation, rows, dtype=self.dtype)
+        if isinstance(representation, str):
+            block_itemsize = GramRDM.read_header(representation)[1].itemsize
+        else:
+            block_itemsize = representation.dtype.itemsize
+        return GramRDM(representation, rows, GramRDM.chunk_size(len(rows), self.max_memory, np.dtype(self.dtype).itemsize,
+                                                                 block_itemsize), self.dtype)
+
+    def pairwise_dsm(self, representation, rows=None):
+        '''
+        Square RDM of the representation computed with the selected backend, metrics that cannot be derived from the
+        Gram matrix are computed with pdist
+
+        @param rows: indices of the rows of the representation to use, None to use all of them
+        '''
+        if self.max_memory is not None:
+            if self.distance not in GramRDM.METRICS:
+                raise Exception('Distance %s cannot be computed within a memory budget' % self.distance)
+            return self.gram_engine(representation, rows).dsm(self.distance)
+        if self.backend == 'gram' and self.distance in GramRDM.METRICS:
+            return GramRDM(representation, rows, dtype=self.dtype).dsm(self.distance)
+        if rows is not None:
+            representation = representation[rows]
+        return scipydist.squareform(scipydist.pdist(representation, self.distance)).astype(self.dtype, copy=False)
+
+    def cached_gram(self, source, filenames, description):
+        '''
+        Gram matrix of the representation (stimuli in category order), computed once and kept in the RDM cache under
+        the 'gram' distance
+
+        @param source: function that returns (representation, rows), called only if the matrix is not cached
+        '''
+        key = self.cache_key(filenames, 'gram')
+        if not RDMCache.exists(key):
+            representation, rows = source()
+            RDMCache.store_matrix(key, self.gram_engine(representation, rows).gram, '%s gram' % description)
+        return RDMCache.load_matrix(key)
+
+    def cache_all_metrics(self, source, filenames, distances, description):
+        '''
+        Compute RDMs of all of the distance metrics from one Gram matrix of the representation and put them into the
+        RDM cache, skipping the ones that are already there
+
+        @param source: function that returns (representation, rows), called only if something has to be computed
+        '''
+        missing = [d for d in distances if not RDMCache.exists(self.cache_key(filenames, d))]
+        if len(missing) == 0:
+            print 'Reusing the cached matrices for %s' % description
+            return
+        print 'Computing %s matrices for %s...' % (', '.join(missing), description)
+        representation, rows = source()
+        engine = self.gram_engine(representation, rows)
+        for distance in missing:
+            RDMCache.store(self.cache_key(filenames, distance), engine.dsm(distance), '%s %s' % (description, distance))
+
     @abstractmethod
     def compute_dsm(self):
         pass
@@ -90,26 +196,71 @@ class RDMPixel(RDM):
     representation = None
     dsm = None
 
-    def __init__(self, distance, featureset, shuffle, load_representation=True):
+    rows = None
+
+    def __init__(self, distance, featureset, shuffle, load_representation=True, backend='pdist', max_memory=None,
+                 dtype=np.float64):
         RDM.__init__(self, distance, featureset, shuffle)
-        self.representation = np.zeros((419, 51529))
+        self.backend = backend
+        self.max_memory = max_memory
+        self.dtype = dtype
+        self.representation = None
+
+        # the matrix does not depend on the featureset, do not load the images if it was computed before
+        if load_representation and not self.shuffle and RDMCache.exists(self.cache_key(self.source_files())):
+            load_representation = False
+
         if load_representation:
-            for i, fname in enumerate(self.dnn_stimuli):
-                self.representation[i] = np.ravel(imread('%s/DNN/imagesdone/%s.jpg' % (self.DATADIR, fname)))
-            self.representation = self.representation[self.reorder_dnn_to_categories]
+            self.representation, self.rows = self.load_representation()
 
             if self.shuffle:
-                new_order = np.random.permutation(range(self.representation.shape[0]))
-                self.representation = self.representation[new_order]
+                new_order = np.random.permutation(range(len(self.reorder_dnn_to_categories)))
+                if self.rows is None:
+                    self.representation = self.representation[new_order]
+                else:
+                    self.rows = self.rows[new_order]
+
+    def load_representation(self):
+        '''
+        @return: (representation, rows), within a memory budget the representation is the path to the decoded
+                 stimulus tensor (see StimulusTensor), which is read chunk by chunk later on, and rows tell which of
+                 its rows to use, otherwise the images are float64 and already ordered by categories
+        '''
+        tensor, names = StimulusTensor.load()
+        if not np.array_equal(names, self.dnn_stimuli):
+            raise Exception('Stimulus tensor %s is out of date, rebuild it with StimulusTensor.py' % StimulusTensor.path())
+
+        if self.max_memory is not None:
+            return StimulusTensor.path(), np.array(self.reorder_dnn_to_categories)
+        return tensor[self.reorder_dnn_to_categories].astype(self.dtype), None
+
+    def source_files(self):
+        return ['%s/DNN/imagesdone/%s.jpg' % (self.DATADIR, fname) for fname in self.dnn_stimuli]
 
     def compute_dsm(self):
-        self.dsm = scipydist.squareform(scipydist.pdist(self.representation, self.distance))
+        if not self.shuffle and RDMCache.exists(self.cache_key(self.source_files())):
+            print 'Reusing the cached pixel matrix'
+            self.dsm = RDMCache.load(self.cache_key(self.source_files()))
+            return
+        self.dsm = self.pairwise_dsm(self.representation, self.rows)
+
+    def compute_and_cache_all_metrics(self, distances):
+        self.cache_all_metrics(self.load_representation, self.source_files(), distances, 'pixels')
+
+    def gram(self):
+        return self.cached_gram(self.load_representation, self.source_files(), 'pixels')
 
     def save_dsm(self):
-        np.savetxt('%s/numbers/dnn-pixels.txt' % self.OUTDIR, self.dsm, fmt='%.6f')
+        if self.shuffle:
+            RDMStore.save('%s/numbers/dnn-pixels' % self.OUTDIR, self.dsm)
+        else:
+            RDMCache.store(self.cache_key(self.source_files()), self.dsm, 'pixels %s' % self.distance)
 
     def load_dsm(self):
-        self.dsm = np.loadtxt('%s/numbers/dnn-pixels.txt' % self.OUTDIR)
+        if self.shuffle:
+            self.dsm = RDMStore.load('%s/numbers/dnn-pixels' % self.OUTDIR)
+        else:
+            self.dsm = self.load_cached_dsm(self.source_files(), '%s/numbers/dnn-pixels' % self.OUTDIR, 'pixels')
 
     def plot_dsm(self):
         #plt.figure();
@@ -126,33 +277,128 @@ class RDMDNN(RDM):
     layers = None
     network = None
 
-    def __init__(self, distance, network, featureset, shuffle, load_representation=True):
+    rows = None
+
+    #: Random projection for approximate RDMs (see SketchRDM), None to compute exact RDMs
+    sketch = None
+
+    #: Number of stimuli on which approximate RDMs are compared to the exact ones
+    sketch_sample = 50
+
+    def __init__(self, distance, network, featureset, shuffle, load_representation=True, backend='pdist', max_memory=None,
+                 sketch=None, sketch_sample=50, dtype=np.float64):
         RDM.__init__(self, distance, featureset, shuffle)
         self.network = network
+        self.backend = backend
+        self.max_memory = max_memory
+        self.sketch = sketch
+        self.sketch_sample = sketch_sample
+        self.dtype = dtype
+        self.dsm = {}
 
         self.layers = sorted(os.listdir('%s/DNN/activations/%s' % (self.CODEDIR, network)))
         self.representation = {}
+        self.rows = {}
         if load_representation:
             for layer in self.layers:
-                self.representation[layer] = np.load('%s/DNN/activations/%s/%s/activations.npy' % (self.CODEDIR, network, layer))
-                self.representation[layer] = self.representation[layer][self.reorder_dnn_to_categories]
+
+                # the matrix does not depend on the featureset, do not load activations if it was computed before
+                if not self.shuffle and RDMCache.exists(self.cache_key(self.source_files(layer))):
+                    continue
+
+                self.representation[layer], self.rows[layer] = self.load_representation(layer)
 
                 if self.shuffle:
-                    new_order = np.random.permutation(range(self.representation[layer].shape[0]))
-                    self.representation[layer] = self.representation[layer][new_order]
+                    new_order = np.random.permutation(range(len(self.reorder_dnn_to_categories)))
+                    if self.rows[layer] is None:
+                        self.representation[layer] = self.representation[layer][new_order]
+                    else:
+                        self.rows[layer] = self.rows[layer][new_order]
+
+    def load_representation(self, layer):
+        '''
+        @return: (representation, rows), within a memory budget the representation is the path to the activations
+                 file, which is read chunk by chunk later on, and rows tell which of the rows to use,
+                 otherwise the activations are loaded and ordered by categories
+        '''
+        if self.max_memory is not None:
+            return self.source_files(layer)[0], np.array(self.reorder_dnn_to_categories)
+
+        representation = np.load('%s/DNN/activations/%s/%s/activations.npy' % (self.CODEDIR, self.network, layer), mmap_mode='r')
+        return representation[self.reorder_dnn_to_categories].astype(self.dtype, copy=False), None
+
+    def source_files(self, layer):
+        return ['%s/DNN/activations/%s/%s/activations.npy' % (self.CODEDIR, self.network, layer)]
+
+    def cache_key(self, filenames, distance=None):
+        '''
+        Approximate RDMs go into the cache under the distance tagged with the sketch, so they never replace exact ones
+        '''
+        distance = self.distance if distance is None else distance
+        if self.sketch is not None:
+            distance = '%s~%s' % (distance, self.sketch)
+        return RDM.cache_key(self, filenames, distance)
+
+    def sketch_dsm(self, layer):
+        '''
+        Approximate RDM of the layer computed on the random projection of the activations. Reports how long it took and
+        how far it is from the exact RDM on a random sample of stimuli.
+        '''
+        representation, rows = self.representation[layer], self.rows[layer]
+        start = time.time()
+        dsm = scipydist.squareform(scipydist.pdist(self.sketch.project(representation, rows, self.distance == 'correlation'),
+                                                        self.distance)).astype(self.dtype)
+        elapsed = time.time() - start
+
+        nstim = dsm.shape[0]
+        sample = np.sort(np.random.RandomState(self.sketch.seed).choice(nstim, min(self.sketch_sample, nstim), replace=False))
+        if rows is None:
+            exact = self.pairwise_dsm(representation[sample])
+        else:
+            exact = self.pairwise_dsm(representation, rows[sample])
+        report = SketchRDM.compare(dsm[sample][:, sample], exact)
+        print '%s %s: %s sketch in %.2fs, distortion mean %.4f max %.4f, Spearman to exact RDM on %d stimuli %.4f' % (
+            self.network, layer, self.sketch, elapsed, report['distortion_mean'], report['distortion_max'], len(sample),
+            report['spearman'])
+
+        return dsm
 
     def compute_dsm(self):
         for layer in self.layers:
+            if not self.shuffle and RDMCache.exists(self.cache_key(self.source_files(layer))):
+                print 'Reusing the cached matrix for layer %s' % layer
+                self.dsm[layer] = RDMCache.load(self.cache_key(self.source_files(layer)))
+                continue
             print 'Computing the matrix for layer %s...' % layer
-            self.dsm[layer] = scipydist.squareform(scipydist.pdist(self.representation[layer], self.distance))
+            if self.sketch is not None:
+                self.dsm[layer] = self.sketch_dsm(layer)
+            else:
+                self.dsm[layer] = self.pairwise_dsm(self.representation[layer], self.rows[layer])
+
+    def compute_and_cache_all_metrics(self, distances):
+        for layer in self.layers:
+            self.cache_all_metrics(lambda: self.load_representation(layer), self.source_files(layer), distances,
+                                   '%s %s' % (self.network, layer))
+
+    def gram(self, layer):
+        return self.cached_gram(lambda: self.load_representation(layer), self.source_files(layer),
+                                '%s %s' % (self.network, layer))
 
     def save_dsm(self):
         for layer in self.layers:
-            np.savetxt('%s/numbers/dnn-%s-%s.txt' % (self.OUTDIR, layer, self.network), self.dsm[layer], fmt='%.6f')
+            if self.shuffle:
+                RDMStore.save('%s/numbers/dnn-%s-%s' % (self.OUTDIR, layer, self.network), self.dsm[layer])
+            else:
+                RDMCache.store(self.cache_key(self.source_files(layer)), self.dsm[layer], '%s %s %s%s' % (
+                    self.network, layer, self.distance, '' if self.sketch is None else ' ~%s' % self.sketch))
 
     def load_dsm(self):
         for layer in self.layers:
-            self.dsm[layer] = np.loadtxt('%s/numbers/dnn-%s-%s.txt' % (self.OUTDIR, layer, self.network))
+            legacy = '%s/numbers/dnn-%s-%s' % (self.OUTDIR, layer, self.network)
+            if self.shuffle:
+                self.dsm[layer] = RDMStore.load(legacy)
+            else:
+                self.dsm[layer] = self.load_cached_dsm(self.source_files(layer), legacy, '%s %s' % (self.network, layer))
 
     def plot_dsm(self):
         for layer in self.layers:
@@ -170,19 +416,36 @@ class RDMBrain(RDM):
     subject = {}
     suffix = ''
 
-    def __init__(self, distance, featureset, sid, shuffle):
+    #: Whether stimuli rejected as artifacts (marked with the poison pill -123456) are left out of the RDMs pair-wise,
+    #: distances to them are then NaN, instead of being treated as zero responses
+    masked = False
+
+    def __init__(self, distance, featureset, sid, shuffle, dtype=np.float64, masked=False):
         print 'WARNING: For brain response distances we use Euclidean distance because brain responses are scalars'
         RDM.__init__(self, distance, featureset, shuffle)
+        self.dtype = dtype
+        self.masked = masked
+        self.subject = {}
         subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (self.DATADIR, featureset)))
         sfile = subjects[sid]
         s = sio.loadmat('%s/Intracranial/Processed/%s/%s' % (self.DATADIR, featureset, sfile))
         self.subject['data'] = s['s']['data'][0][0]
         self.subject['name'] = s['s']['name'][0][0][0]
+        self.subject['mni'] = s['s']['probes'][0][0][0][0][2]
+        self.subject['areas'] = np.ravel(s['s']['probes'][0][0][0][0][3])
         print self.subject['name']
-        self.representation = self.subject['data'][self.reorder_stimulation_to_categories]
-
-        # disable the poison pill
-        self.representation[self.representation == -123456] = 0.0
+        self.representation = self.subject['data'][self.reorder_stimulation_to_categories].astype(self.dtype)
+
+        # disable the poison pill, masked RDMs are kept in a directory of their own
+        if self.masked:
+            self.representation[self.representation == -123456] = np.nan
+            self.suffix = '.masked'
+            try:
+                os.makedirs('%s%s/numbers' % (self.OUTDIR, self.suffix))
+            except:
+                pass
+        else:
+            self.representation[self.representation == -123456] = 0.0
 
         if self.shuffle:
             new_order = np.random.permutation(range(self.representation.shape[0]))
@@ -194,14 +457,69 @@ class RDMBrain(RDM):
         nprobes = self.representation.shape[1]
 
         if nprobes == 0:
-            sm = np.zeros((nstim, nstim))
-            np.savetxt('%s%s/numbers/brain-%s-%d.txt' % (self.OUTDIR, self.suffix, self.subject['name'], 0), sm, fmt='%.3f')
+            sm = np.zeros(nstim * (nstim - 1) / 2)
+            RDMStore.save('%s%s/numbers/brain-%s-%d' % (self.OUTDIR, self.suffix, self.subject['name'], 0), sm)
             return None
 
         for p in range(nprobes):
-            #sm = scipydist.squareform(scipydist.pdist(self.representation[:, p].reshape((nstim, 1)), self.distance))
-            sm = scipydist.squareform(scipydist.pdist(self.representation[:, p].reshape((nstim, 1)), 'euclidean'))
-            np.savetxt('%s%s/numbers/brain-%s-%d.txt' % (self.OUTDIR, self.suffix, self.subject['name'], p), sm, fmt='%.3f')
+            #sm = scipydist.pdist(self.representation[:, p].reshape((nstim, 1)), self.distance)
+            sm = scipydist.pdist(self.representation[:, p].reshape((nstim, 1)), 'euclidean')
+            RDMStore.save('%s%s/numbers/brain-%s-%d' % (self.OUTDIR, self.suffix, self.subject['name'], p), sm)
+
+    def compute_batch_dsm(self):
+        '''
+        RDMs of all of the probes at once, computed with one broadcast over the probe axis instead of a pdist call per
+        probe. These are the same matrices compute_and_save_batch_dsm() stores, so storing them is optional.
+
+        @return: [nprobes x nstim x nstim] array, a subject without probes gets one all-zeros RDM
+        '''
+        nstim = self.representation.shape[0]
+        if self.representation.shape[1] == 0:
+            return np.zeros((1, nstim, nstim), dtype=self.dtype)
+        responses = self.representation.T
+        return np.abs(responses[:, :, np.newaxis] - responses[:, np.newaxis, :])
+
+    @staticmethod
+    def dsm_masks(dsms):
+        '''
+        Stimuli each of the masked RDMs keeps: the ones that have a distance to at least one other stimulus
+
+        @param dsms: [nprobes x nstim x nstim] RDMs, NaN where a pair involves a rejected stimulus
+        @return:     [nprobes x nstim] boolean mask
+        '''
+        offdiagonal = ~np.eye(dsms.shape[1], dtype=bool)
+        return np.any(~np.isnan(dsms) & offdiagonal[np.newaxis], axis=2)
+
+    @staticmethod
+    def pool_subjects(distance, featureset, dtype=np.float64):
+        '''
+        Responses of the probes of all of the subjects of a featureset side by side, stimuli are in category order for
+        all of them, subjects without probes are left out
+
+        @return: dictionary with
+                 responses: [nstim x nprobes] responses
+                 mni:       [nprobes x 3] MNI coordinates
+                 areas:     area of each of the probes
+                 names:     subject name of each of the probes
+                 pids:      ID of each of the probes within its subject
+        '''
+        subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RDM.DATADIR, featureset)))
+        pooled = {'responses': [], 'mni': [], 'areas': [], 'names': [], 'pids': []}
+        for sid in range(len(subjects)):
+            rdm = RDMBrain(distance, featureset, sid, False, dtype)
+            nprobes = rdm.representation.shape[1]
+            if nprobes == 0:
+                continue
+            pooled['responses'].append(rdm.representation)
+            pooled['mni'].append(np.reshape(rdm.subject['mni'], (nprobes, 3)).astype(np.float64))
+            pooled['areas'].append(rdm.subject['areas'].astype(np.int64))
+            pooled['names'].append([rdm.subject['name']] * nprobes)
+            pooled['pids'].append(np.arange(nprobes))
+        return {'responses': np.hstack(pooled['responses']),
+                'mni': np.vstack(pooled['mni']),
+                'areas': np.concatenate(pooled['areas']),
+                'names': np.concatenate(pooled['names']),
+                'pids': np.concatenate(pooled['pids'])}
 
     def compute_dsm(self, pid):
         if self.shuffle:
@@ -221,21 +539,50 @@ class RDMBrain(RDM):
         if self.shuffle:
             raise Exception("return_dsm() for Brain RDM cannot be used in shuffle=True mode, use compute_dsm() instead")
         else:
-            return np.loadtxt('%s/RSA/%s.%s%s/numbers/brain-%s-%d.txt' % (self.DATADIR, self.featureset, self.distance,
-                                                                         self.suffix, self.subject['name'], pid))
+            return RDMStore.load('%s/RSA/%s.%s%s/numbers/brain-%s-%d' % (self.DATADIR, self.featureset, self.distance,
+                                                                        self.suffix, self.subject['name'], pid))
 
     def plot_dsm(self):
         raise Exception("plot_dsm() is not in use for Brain RDM")
 
 
+def compute_and_save_subject_brain_dsm(args):
+    '''
+    Worker of the --all-subjects mode: compute and store RDMs of all probes of one subject
+
+    @param args: (distance, featureset, sid, shuffle, masked) tuple
+    @return:     (sid, subject name, number of probes, seconds it took)
+    '''
+    distance, featureset, sid, shuffle, masked = args
+    start = time.time()
+
+    # forked workers inherit the state of the random generator, reseed so that subjects are not shuffled identically
+    if shuffle:
+        np.random.seed()
+
+    rdm = RDMBrain(distance, featureset, sid, shuffle, masked=masked)
+    rdm.compute_and_save_batch_dsm()
+    return sid, rdm.subject['name'], rdm.representation.shape[1], time.time() - start
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Compute RDM matrices')
     parser.add_argument('-t', '--type', dest='datatype', type=str, required=True, help='The data source: pixels, dnn or brain')
-    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use (comma-separated list to compute several metrics for pixels or dnn with "-b gram")')
+    parser.add_argument('-b', '--backend', dest='backend', type=str, required=False, default='pdist', help='How to compute distances for pixels or dnn: pdist or gram')
     parser.add_argument('-n', '--network', dest='network', type=str, required=False, help='DNN activations for DNN RDMs')
     parser.add_argument('-i', '--sid', dest='sid', type=int, required=False, help='Subject ID for Brain RDM')
+    parser.add_argument('-m', '--max-memory', dest='maxmemory', type=int, required=False, help='Memory budget in MB for pixels or dnn, distances are then accumulated over chunks of features')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type for pixels or dnn: float64 or float32')
+    parser.add_argument('-k', '--sketch', dest='sketch', type=int, required=False, help='Approximate DNN RDMs: project activations to this many dimensions before computing distances')
+    parser.add_argument('--sketch-type', dest='sketchtype', type=str, required=False, default='gaussian', help='Random projection for approximate RDMs: gaussian or sparse')
+    parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help='Seed of the random projection')
+    parser.add_argument('--sample', dest='sample', type=int, required=False, default=50, help='Number of stimuli to compare approximate RDMs to exact ones on')
+    parser.add_argument('-a', '--all-subjects', dest='allsubjects', type=str, required=False, default=False, help='Whether to compute Brain RDMs of all subjects in a pool of processes instead of one subject (-i)')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, required=False, default=multiprocessing.cpu_count(), help='Number of worker processes for --all-subjects')
     parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+    parser.add_argument('--masked', dest='masked', type=str, required=False, default=False, help='Whether to leave stimuli rejected as artifacts out of Brain RDMs instead of setting their responses to 0')
     parser.add_argument('-s', '--shuffle', dest='shuffle', type=str, required=False, default=False, help='Whether to shuffle data for a permutation test')
     args = parser.parse_args()
     datatype = str(args.datatype)
@@ -244,25 +591,74 @@ if __name__ == '__main__':
     sid = int(args.sid) if args.sid is not None else None
     featureset = str(args.featureset)
     shuffle = bool(args.shuffle == 'True')
+    backend = str(args.backend)
+    allsubjects = bool(args.allsubjects == 'True')
+    workers = int(args.workers)
+    masked = bool(args.masked == 'True')
+    dtype = np.dtype(str(args.precision)).type
+    max_memory = int(args.maxmemory) * 1024 * 1024 if args.maxmemory is not None else None
+    sketch = SketchRDM(int(args.sketch), str(args.sketchtype), int(args.seed)) if args.sketch is not None else None
+    if sketch is not None and (datatype != 'dnn' or len(distance.split(',')) > 1):
+        raise Exception("Approximate RDMs (-k) can be computed only for dnn and one distance metric")
+
+    # several metrics at once are computed from one Gram matrix and go straight into the RDM cache
+    distances = distance.split(',')
+    if len(distances) > 1:
+        if datatype not in ['pixels', 'dnn'] or backend != 'gram' or shuffle:
+            raise Exception("Several distance metrics can be computed only for pixels or dnn with -b gram and without shuffling")
+        for d in distances:
+            if d not in GramRDM.METRICS:
+                raise Exception("Distance %s cannot be computed from the Gram matrix" % d)
 
     if datatype == 'pixels':
-        rdm = RDMPixel(distance, featureset, shuffle)
-        rdm.compute_dsm()
-        rdm.save_dsm()
+        if len(distances) > 1:
+            rdm = RDMPixel(distances[0], featureset, shuffle, load_representation=False, backend=backend, max_memory=max_memory,
+                           dtype=dtype)
+            rdm.compute_and_cache_all_metrics(distances)
+        else:
+            rdm = RDMPixel(distance, featureset, shuffle, backend=backend, max_memory=max_memory, dtype=dtype)
+            rdm.compute_dsm()
+            rdm.save_dsm()
 
     elif datatype == 'dnn':
         if network == 'None':
             raise Exception("Activation (-a) is a required argument for DNN RDM")
-        rdm = RDMDNN(distance, network, featureset, shuffle)
-        rdm.compute_dsm()
-        rdm.save_dsm()
+        if len(distances) > 1:
+            rdm = RDMDNN(distances[0], network, featureset, shuffle, load_representation=False, backend=backend, max_memory=max_memory,
+                         dtype=dtype)
+            rdm.compute_and_cache_all_metrics(distances)
+        else:
+            rdm = RDMDNN(distance, network, featureset, shuffle, backend=backend, max_memory=max_memory,
+                         sketch=sketch, sketch_sample=int(args.sample), dtype=dtype)
+            rdm.compute_dsm()
+            rdm.save_dsm()
+
+    elif datatype == 'brain' and allsubjects:
+
+        # stimulus reorderings are computed before forking so that the workers inherit them
+        RDM.load_stimulus_orderings()
+        nsubjects = len(os.listdir('%s/Intracranial/Processed/%s/' % (RDM.DATADIR, featureset)))
+
+        start = time.time()
+        pool = multiprocessing.Pool(workers)
+        for sid, sname, nprobes, elapsed in pool.imap_unordered(compute_and_save_subject_brain_dsm,
+                                                                [(distance, featureset, s, shuffle, masked) for s in range(nsubjects)]):
+            print 'Subject %d %s: %d probes in %.2fs' % (sid, sname, nprobes, elapsed)
+        pool.close()
+        pool.join()
+        print 'All %d subjects done in %.2fs with %d workers' % (nsubjects, time.time() - start, workers)
 
     elif datatype == 'brain':
         if sid is None:
             raise Exception("Subject ID (-i) is a required argument for Brain RDM")
-        rdm = RDMBrain(distance, featureset, sid, shuffle)
+        rdm = RDMBrain(distance, featureset, sid, shuffle, masked=masked)
         rdm.compute_and_save_batch_dsm()
 
     else:
         print 'ERROR: Unknown data source %s' % source
 
+    # ru_maxrss is in kilobytes on Linux
+    # brain RDMs of all subjects are computed in the pool workers, whose peak is not part of this process
+    print 'Peak RSS: %.1f MB, of a worker: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                                                     resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
+
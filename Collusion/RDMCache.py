@@ -0,0 +1,117 @@
+import os
+import hashlib
+import numpy as np
+from RDMStore import RDMStore
+
+
+class RDMCache:
+    '''
+    Featureset-independent store of DNN and pixel RDMs.
+
+    Those RDMs depend only on the data they were computed from, on the distance metric and on the order of stimuli,
+    so they are stored under a key that is a digest of exactly these inputs and are shared by all featuresets.
+    Digests of the source files are memoized by file path, size, inode and modification time, so that resolving a key
+    does not require to read the whole activation file every time. All files are written atomically, jobs that miss
+    the cache at the same time may write the same entry but never see each other's half-written files.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    CACHEDIR = '%s/RSA/Cache' % DATADIR
+
+    #: Version of the way keys are computed, change it to invalidate the whole cache
+    VERSION = '1'
+
+    @staticmethod
+    def _mkdir(directory):
+        try:
+            os.makedirs(directory)
+        except:
+            pass
+
+    @staticmethod
+    def file_digest(filenames):
+        '''
+        @param filenames: list of files the RDM is computed from (in the order they are used)
+        @return:          SHA1 digest of the content of the files
+        '''
+
+        # look up the memoized digest
+        stat = hashlib.sha1()
+        for filename in filenames:
+            info = os.stat(filename)
+            stat.update('%s:%d:%d:%r;' % (os.path.abspath(filename), info.st_size, info.st_ino, info.st_mtime))
+        memofile = '%s/digests/%s' % (RDMCache.CACHEDIR, stat.hexdigest())
+        if os.path.exists(memofile):
+            with open(memofile, 'r') as f:
+                digest = f.read().strip()
+            if digest != '':
+                return digest
+
+        # compute the digest of the content
+        digest = hashlib.sha1()
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 24), ''):
+                    digest.update(block)
+        digest = digest.hexdigest()
+
+        RDMCache._mkdir('%s/digests' % RDMCache.CACHEDIR)
+        RDMStore.atomic_write(memofile, lambda f: f.write(digest), 'w')
+
+        return digest
+
+    @staticmethod
+    def key(source_digest, distance, reorder):
+        '''
+        @param source_digest: digest of the data the RDM is computed from, see file_digest()
+        @param distance:      the distance metric
+        @param reorder:       indices of the rows of the data that are used to compute the RDM, in that order
+        '''
+        key = hashlib.sha1()
+        key.update('%s;%s;%s;' % (RDMCache.VERSION, source_digest, distance))
+        key.update(np.asarray(reorder, dtype=np.int64).tobytes())
+        return key.hexdigest()
+
+    @staticmethod
+    def path(key):
+        return '%s/%s' % (RDMCache.CACHEDIR, key)
+
+    @staticmethod
+    def exists(key):
+        return RDMStore.exists(RDMCache.path(key))
+
+    @staticmethod
+    def store(key, dsm, description=''):
+        '''
+        @param description: human-readable note on what the RDM is, goes to the index of the cache
+        '''
+        if RDMCache.exists(key):
+            return
+        RDMCache._mkdir(RDMCache.CACHEDIR)
+        RDMStore.save(RDMCache.path(key), dsm)
+        with open('%s/index.txt' % RDMCache.CACHEDIR, 'a') as f:
+            f.write('%s %s\n' % (key, description))
+
+    @staticmethod
+    def load(key):
+        return RDMStore.load(RDMCache.path(key))
+
+    @staticmethod
+    def store_matrix(key, matrix, description=''):
+        '''
+        Store a square matrix that is not an RDM (e.g. a Gram matrix, which has a diagonal) as it is
+        '''
+        if RDMCache.exists(key):
+            return
+        RDMCache._mkdir(RDMCache.CACHEDIR)
+        RDMStore.save_array(RDMCache.path(key) + RDMStore.EXTENSION, matrix)
+        with open('%s/index.txt' % RDMCache.CACHEDIR, 'a') as f:
+            f.write('%s %s\n' % (key, description))
+
+    @staticmethod
+    def load_matrix(key):
+        '''
+        @return: read-only memory map of a matrix stored with store_matrix()
+        '''
+        return np.load(RDMCache.path(key) + RDMStore.EXTENSION, mmap_mode='r')
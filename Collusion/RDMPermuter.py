@@ -1,16 +1,22 @@
 import os
+import time
+import resource
 import argparse
 import numpy as np
 from RDM import RDMPixel, RDMDNN, RDMBrain
-from scipy.stats import spearmanr
+from RankCorrelation import RankCorrelation
 
 class RDMPermuter:
 
     #: Number of runs per iteration
     nruns = 10000
 
+    #: Layers the brain RDM is scored against, pixel space included
+    layers = ['pixels', 'conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'fc6', 'fc7', 'fc8']
+
     #: Paths
     DATADIR = '../../Data'
+    SCOREDIR = None
     PERMDIR = None
 
     #: Current p-values
@@ -28,9 +34,26 @@ class RDMPermuter:
     sid = None
     sname = None
     pid = None
-    
 
-    def __init__(self, sid, pid, backbone, featureset, distance, suffix, scope, threshold, network):
+    #: Whether the brain RDM is computed from the responses on the fly instead of being loaded from disk
+    virtual = False
+
+    #: Floating point type of RDMs and scores: np.float64 or np.float32 (halves the chunks of permuted RDMs)
+    dtype = np.float64
+
+    #: Memory ceiling in bytes for one chunk of permuted RDMs and the temporaries of ranking them
+    max_memory = 256 * 1024 * 1024
+
+    #: Whether to stop permuting a (probe, layer) pair as soon as its p-value is known to be above alpha (sequential
+    #: Monte Carlo test of Besag and Clifford), alpha is the significance level Mapper filters scores with
+    sequential = False
+    alpha = 0.001
+
+    #: Number of permutations used for each (probe, layer) pair by the last computation, [nprobes x nlayers]
+    nused = None
+
+    def __init__(self, sid, pid, backbone, featureset, distance, suffix, scope, threshold, network, virtual=False,
+                 dtype=np.float64, max_memory=256 * 1024 * 1024):
         self.sid = sid
         self.pid = pid
         self.backbone = backbone
@@ -40,7 +63,11 @@ class RDMPermuter:
         self.scope = scope
         self.threshold = threshold
         self.network = network
+        self.virtual = virtual
+        self.dtype = dtype
+        self.max_memory = max_memory
 
+        self.SCOREDIR = '%s/Intracranial/Probe_to_Layer_Maps/%s_%s.%s%s.%s.%s%s' % (self.DATADIR, self.backbone, self.featureset, self.distance, self.suffix, self.network, self.scope, ('%.10f' % self.threshold)[2:].rstrip('0'))
         self.PERMDIR = '%s/Intracranial/Probe_to_Layer_Maps/Permutation/%s_%s.%s%s.%s.%s%s' % (self.DATADIR, self.backbone, self.featureset, self.distance, self.suffix, self.network, self.scope, ('%.10f' % self.threshold)[2:].rstrip('0'))
 
         # load list of subjects
@@ -55,57 +82,222 @@ class RDMPermuter:
 
     def run(self):
 
+        # all probes of the subject at once
+        if self.pid is None:
+            scores = self.compute_subject_permutation_scores()
+            for pid in range(len(scores)):
+                self.store_permutation_scores(pid, scores[pid], self.nused[pid])
+            print 'Done with %s (%d - all %d probes)' % (self.sname, self.sid, len(scores))
+        else:
+            scores = self.compute_permutation_scores()
+            self.store_permutation_scores(self.pid, scores, self.nused[0])
+            print 'Done with %s (%d - %d)' % (self.sname, self.sid, self.pid)
+
+        if self.sequential:
+            print 'Sequential test used %.1f permutations per probe and layer on average (%.1f%% of %d)' % (
+                np.mean(self.nused), 100.0 * np.mean(self.nused) / self.nruns, self.nruns)
+
+    def store_permutation_scores(self, pid, scores, nused):
+        '''
+        Save permutation scores of one probe, with the sequential test only the permutations up to the last one used by
+        any of the layers are saved (NaN after the last one used by a layer). The number of permutations used by each
+        of the layers goes to <sname>-<pid>.nperm.txt for Mapper to compute p-values with, it is written by every run
+        (nruns for all of the layers without the sequential test) so that it never stays behind from an earlier run
+        '''
+        if self.sequential:
+            scores = scores[:np.max(nused)]
+        np.savetxt('%s/%s-%d.txt' % (self.PERMDIR, self.sname, pid), scores, fmt='%.6f')
+        np.savetxt('%s/%s-%d.nperm.txt' % (self.PERMDIR, self.sname, pid), nused, fmt='%d')
+
+    def load_observed_scores(self):
+        '''
+        @return: [nprobes x nlayers] true scores of the subject as Mapper reads them, None if the subject has no probes
+        '''
+        scores = np.loadtxt('%s/%s.txt' % (self.SCOREDIR, self.sname))
+        if len(scores) == 0:
+            return None
+        return scores.reshape((-1, len(self.layers)))
+
+    def stop_count(self):
+        '''
+        @return: number of permutation scores at or above the true one after which the p-value is above alpha however
+                 the remaining permutations turn out, i.e. the smallest k such that k / nruns > alpha as Mapper computes
+                 p-values
+        '''
+        return int(np.argmax(np.arange(self.nruns + 2) / float(self.nruns) > self.alpha))
+
+    def compute_permutation_scores(self):
+        '''
+        @return: [nruns x nlayers] scores of the layer RDMs against randomly permuted brain RDMs
+        '''
+
         # load true RDM
         print self.sid, self.pid, self.sname
-        rdm_brain = RDMBrain(self.distance, self.featureset, self.sid, False)
-        brain_dsm = rdm_brain.return_dsm(self.pid)
+        rdm_brain = RDMBrain(self.distance, self.featureset, self.sid, False, self.dtype)
+        if self.virtual:
+            brain_dsm = rdm_brain.compute_batch_dsm()[self.pid]
+        else:
+            brain_dsm = rdm_brain.return_dsm(self.pid).astype(self.dtype, copy=False)
+
+        observed = self.load_observed_scores() if self.sequential else None
+        if observed is not None:
+            observed = observed[self.pid][np.newaxis]
+        return self.permutation_scores(brain_dsm[np.newaxis], observed)[0]
+
+    def compute_subject_permutation_scores(self):
+        '''
+        Permutation scores of all probes of the subject in one pass, every permutation is applied to all of them
+
+        @return: [nprobes x nruns x nlayers] scores, a subject without probes gets scores of one all-zeros RDM
+        '''
+        print self.sid, 'all probes', self.sname
+        rdm_brain = RDMBrain(self.distance, self.featureset, self.sid, False, self.dtype)
+        if self.virtual:
+            brain_dsms = rdm_brain.compute_batch_dsm()
+        else:
+            nprobes = max(1, rdm_brain.representation.shape[1])
+            brain_dsms = np.array([rdm_brain.return_dsm(pid) for pid in range(nprobes)], dtype=self.dtype)
+
+        observed = self.load_observed_scores() if self.sequential else None
+        return self.permutation_scores(brain_dsms, observed)
+
+    def permutation_scores(self, brain_dsms, observed=None):
+        '''
+        Permutation scores, number of permutations used by each (probe, layer) pair is kept in nused
+
+        @param brain_dsms: [nprobes x nstim x nstim] brain RDMs
+        @param observed:   [nprobes x nlayers] true scores for the sequential test, None to use all of the permutations
+        @return:           [nprobes x nruns x nlayers] scores of the layer RDMs against the brain RDMs under the same
+                           random permutations of stimuli, NaN after the last permutation used by a pair
+        '''
 
         # load DNN RDMs
-        layers = ['pixels', 'conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'fc6', 'fc7', 'fc8']
-        pixel_rdm = RDMPixel(self.distance, self.featureset, shuffle=False, load_representation=False)
+        layers = self.layers
+        pixel_rdm = RDMPixel(self.distance, self.featureset, shuffle=False, load_representation=False, dtype=self.dtype)
         pixel_rdm.load_dsm()
-        layer_rdm = RDMDNN(self.distance, self.network, self.featureset, shuffle=False, load_representation=False)
+        layer_rdm = RDMDNN(self.distance, self.network, self.featureset, shuffle=False, load_representation=False, dtype=self.dtype)
         layer_rdm.load_dsm()
         
-        # generate random brain RDM permutations into 10000 x 72631 matrix
-        brain_dsms = np.zeros((self.nruns, brain_dsm.shape[0] * brain_dsm.shape[1])) # 10000 x 72361
-        for i in range(self.nruns):
-            new_order = np.random.permutation(range(brain_dsm.shape[0]))
-            brain_dsms[i, :] = np.ravel(brain_dsm[new_order, :][:, new_order])
-
-        # store layer RDMs into one 9 x 72361 matrix
-        layer_dsms = np.zeros((len(layers), brain_dsm.shape[0] * brain_dsm.shape[1]))
+        # store layer RDMs into one 9 x 72361 matrix and rank them once
+        nprobes, nstim = brain_dsms.shape[:2]
+        layer_dsms = np.zeros((len(layers), nstim * nstim), dtype=self.dtype)
         for lid, layer in enumerate(layers):
             if layer == 'pixels':
                 layer_dsms[lid, :] = np.ravel(pixel_rdm.dsm)
             else:
                 layer_dsms[lid, :] = np.ravel(layer_rdm.dsm[layer])
+        layer_ranks = RankCorrelation.standardize_rows(RankCorrelation.rank_rows(layer_dsms)).astype(self.dtype)
 
-        # compute scores with hackily optimized call to scipy.stats.spearmanr
-        scores = np.zeros((self.nruns, len(layers)))
-        for st in np.arange(0, self.nruns, 1000):
-            scores[st:st + 1000, :] = spearmanr(brain_dsms[st:st + 1000, :], layer_dsms, axis=1).correlation[:1000, 1000:]
+        # permuting rows and columns of a brain RDM only permutes its entries, so each of them is ranked and
+        # standardized once and a permutation is a gather of the standardized ranks of all of the probes at once,
+        # Spearman correlation is then their product with the standardized ranks of the layers as in
+        # scipy.stats.spearmanr
+        brain_ranks = np.empty((nprobes, nstim * nstim), dtype=self.dtype)
+        for pid in range(nprobes):
+            brain_ranks[pid] = RankCorrelation.standardize_rows(RankCorrelation.rank_rows(np.ravel(brain_dsms[pid])[np.newaxis]))[0]
+        scores = np.zeros((nprobes, self.nruns, len(layers)), dtype=self.dtype)
 
-        # save all scores
-        np.savetxt('%s/%s-%d.txt' % (self.PERMDIR, self.sname, pid), scores, fmt='%.6f')
-        print 'Done with %s (%d - %d)' % (self.sname, self.sid, self.pid)
+        # sequential test: a pair stops at the permutation that brings the count of its permutation scores at or above
+        # the true score (compared as Mapper does, after rounding to the saved precision) to stop_count(), the count can
+        # only grow so the p-value over all of the permutations would be above alpha too and decisions are the same,
+        # probes stop being gathered once all of their layers stopped
+        self.nused = np.full((nprobes, len(layers)), self.nruns, dtype=np.int64)
+        stopped = np.zeros((nprobes, len(layers)), dtype=bool)
+        exceeding = np.zeros((nprobes, len(layers)), dtype=np.int64)
+        active = np.arange(nprobes)
+        stop_count = self.stop_count()
+
+        # the gather indices and the permuted ranks of a chunk go to buffers allocated once, so a chunk never exists
+        # next to the previous one, each probe is gathered into its part of the buffer (mode='raise' would buffer out
+        # again, the indices are always in range)
+        nvalues = layer_dsms.shape[1]
+        chunk = self.chunk_size(nvalues, nprobes)
+        indices_buffer = np.empty(chunk * nvalues, dtype=np.intp)
+        permuted_buffer = np.empty(nprobes * chunk * nvalues, dtype=self.dtype)
+        for st, orders in self.permutations(nstim, chunk):
+            nchunk = len(orders)
+            indices = indices_buffer[:nchunk * nvalues].reshape((nchunk, nstim, nstim))
+            np.add(orders[:, :, np.newaxis] * nstim, orders[:, np.newaxis, :], out=indices)
+            indices = indices.reshape((nchunk, nvalues))
+            permuted = permuted_buffer[:len(active) * nchunk * nvalues].reshape((len(active), nchunk, nvalues))
+            for i, pid in enumerate(active):
+                np.take(brain_ranks[pid], indices, out=permuted[i], mode='clip')
+            chunk_scores = np.dot(permuted, layer_ranks.T)
+            scores[active, st:st + nchunk, :] = chunk_scores
+            if observed is None:
+                continue
+
+            counts = np.cumsum(np.round(chunk_scores.astype(np.float64), 6) >= observed[active][:, np.newaxis, :], axis=1)
+            counts += exceeding[active][:, np.newaxis, :]
+            reached = counts >= stop_count
+            stopping = reached.any(axis=1) & ~stopped[active]
+            nused = self.nused[active]
+            nused[stopping] = st + np.argmax(reached, axis=1)[stopping] + 1
+            self.nused[active] = nused
+            stopped[active] |= stopping
+            exceeding[active] = counts[:, -1, :]
+            active = np.flatnonzero(~np.all(stopped, axis=1))
+            if len(active) == 0:
+                break
+
+        if observed is not None:
+            scores[np.arange(self.nruns)[np.newaxis, :, np.newaxis] >= self.nused[:, np.newaxis, :]] = np.nan
+        return scores
+
+    def chunk_size(self, nvalues, nprobes=1):
+        '''
+        @param nvalues: number of values in one raveled RDM
+        @param nprobes: number of brain RDMs each permutation is applied to
+        @return:        number of permutations per chunk so that everything allocated for a chunk stays under the
+                        memory ceiling: the buffers of gather indices (int64) and of the gathered ranks of all of the
+                        probes, and the per-score temporaries of the scores and of the sequential test (at most 32
+                        bytes per probe and layer, against nvalues per probe the permutations themselves are negligible)
+        '''
+        per_run = nvalues * (8 + nprobes * np.dtype(self.dtype).itemsize) + nprobes * len(self.layers) * 32
+        return int(max(1, min(self.nruns, self.max_memory / per_run)))
+
+    def permutations(self, nstim, chunk):
+        '''
+        Generate random permutations of stimuli chunk by chunk, only one chunk exists at a time. Permutations are drawn
+        in the same order as if all of them were generated at once, so results for a seed do not depend on the chunk
+        size.
+
+        @return: generator of (index of the first permutation, [nchunk x nstim] permutations)
+        '''
+        for st in range(0, self.nruns, chunk):
+            nchunk = min(chunk, self.nruns - st)
+            orders = np.empty((nchunk, nstim), dtype=np.int64)
+            for i in range(nchunk):
+                orders[i] = np.random.permutation(range(nstim))
+            yield st, orders
 
 
 if __name__ == '__main__':
     
     parser = argparse.ArgumentParser(description='Compute RDM matrices')
     parser.add_argument('-i', '--sid', dest='sid', type=int, required=True, help='Subject ID')
-    parser.add_argument('-p', '--pid', dest='pid', type=int, required=True, help='Probe ID')
+    parser.add_argument('-p', '--pid', dest='pid', type=int, required=False, help='Probe ID')
+    parser.add_argument('-a', '--all-probes', dest='allprobes', type=str, required=False, default=False, help='Whether to process all probes of the subject in one job instead of one probe (-p), each permutation is applied to all of them')
     parser.add_argument('-b', '--backbone', dest='backbone', type=str, required=True, help='RSA or Linear')
     parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
     parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use')
     parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=True, help='image or matrix depending on which you to compute the correlation on')
     parser.add_argument('-t', '--threshold', dest='threshold', type=float, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
     parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Which activations of DNN to use')
-        
+    parser.add_argument('-v', '--virtual', dest='virtual', type=str, required=False, default=False, help='Whether to compute the brain RDM from the responses instead of loading it from disk')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type of RDMs and scores: float64 or float32')
+    parser.add_argument('-r', '--nruns', dest='nruns', type=int, required=False, default=10000, help='Number of permutations')
+    parser.add_argument('-m', '--max-memory', dest='maxmemory', type=int, required=False, default=256, help='Memory ceiling in MB for a chunk of permutations')
+    parser.add_argument('-s', '--sequential', dest='sequential', type=str, required=False, default=False, help='Whether to stop permuting a probe-layer pair once its p-value is known to be above alpha (needs the true scores computed by RSAScorer)')
+    parser.add_argument('--alpha', dest='alpha', type=float, required=False, default=0.001, help='Significance level of the sequential test, the one Mapper filters scores with')
     args = parser.parse_args()
     sid = int(args.sid)
-    pid = int(args.pid)
+    pid = int(args.pid) if args.pid is not None else None
+    allprobes = bool(args.allprobes == 'True')
+    if allprobes:
+        pid = None
+    elif pid is None:
+        raise Exception("Probe ID (-p) is a required argument without --all-probes")
     backbone = str(args.backbone)
     featureset = str(args.featureset)
     distance = str(args.distance)
@@ -113,9 +305,18 @@ if __name__ == '__main__':
     scope = str(args.onwhat)
     threshold = float(args.threshold)
     network = str(args.network)
+    virtual = bool(args.virtual == 'True')
+    dtype = np.dtype(str(args.precision)).type
 
-    permuter = RDMPermuter(sid, pid, backbone, featureset, distance, suffix, scope, threshold, network)
+    start = time.time()
+    permuter = RDMPermuter(sid, pid, backbone, featureset, distance, suffix, scope, threshold, network, virtual, dtype,
+                           int(args.maxmemory) * 1024 * 1024)
+    permuter.nruns = int(args.nruns)
+    permuter.sequential = bool(args.sequential == 'True')
+    permuter.alpha = float(args.alpha)
     permuter.run()
+    print '%d permutations in %.2fs, peak RSS: %.1f MB' % (permuter.nruns, time.time() - start,
+                                                          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
 
 
 
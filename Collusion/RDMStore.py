@@ -0,0 +1,129 @@
+import os
+import glob
+import argparse
+import tempfile
+import numpy as np
+from scipy.spatial import distance as scipydist
+
+
+class RDMStore:
+    '''
+    Binary storage for RDM matrices.
+
+    An RDM is symmetric and has zeros on the diagonal, so only its condensed upper triangle (in the same layout as
+    scipy.spatial.distance.pdist returns it) is written to disk as a float64 (or float32 if the RDM is float32) .npy
+    file. Such a file is opened with memory mapping and does not need any parsing. RDMs stored as text matrices by
+    earlier versions of the pipeline are still readable, but are never written.
+    '''
+
+    #: Extension of the binary RDM files
+    EXTENSION = '.npy'
+
+    #: Extension of the old text RDM files
+    LEGACY_EXTENSION = '.txt'
+
+    @staticmethod
+    def atomic_write(filename, write, mode='wb'):
+        '''
+        Write a file so that readers never see it half-written: the content goes to a temporary file in the same
+        directory, which is then renamed into place (several jobs may write the same file at the same time)
+
+        @param write: function that writes the content into the given open file
+        '''
+        temporary = RDMStore.temporary_path(filename)
+        try:
+            with open(temporary, mode) as f:
+                write(f)
+            os.rename(temporary, filename)
+        except:
+            os.remove(temporary)
+            raise
+
+    @staticmethod
+    def temporary_path(filename):
+        '''
+        @return: path of a new empty file in the directory of the given one, to be written and renamed into its place
+        '''
+        directory, name = os.path.split(filename)
+        handle, temporary = tempfile.mkstemp(dir=directory if directory != '' else '.', prefix='.%s.' % name)
+        os.close(handle)
+        os.chmod(temporary, 0644)
+        return temporary
+
+    @staticmethod
+    def save_array(filename, array):
+        '''
+        @param filename: path to the .npy file
+        '''
+        RDMStore.atomic_write(filename, lambda f: np.save(f, array))
+
+    @staticmethod
+    def save(basename, dsm):
+        '''
+        @param basename: path to the RDM file without the extension
+        @param dsm:      either square RDM or its condensed form
+        '''
+        dsm = np.asarray(dsm)
+        if dsm.dtype != np.float32:
+            dsm = dsm.astype(np.float64)
+        if dsm.ndim == 2:
+            dsm = scipydist.squareform(dsm, checks=False)
+        RDMStore.save_array(basename + RDMStore.EXTENSION, dsm)
+
+    @staticmethod
+    def exists(basename):
+        return os.path.exists(basename + RDMStore.EXTENSION) or os.path.exists(basename + RDMStore.LEGACY_EXTENSION)
+
+    @staticmethod
+    def load_condensed(basename, mmap=True):
+        '''
+        @param basename: path to the RDM file without the extension
+        @param mmap:     whether to memory map the binary file (read-only) instead of reading it into memory
+        @return:         condensed RDM
+        '''
+        if os.path.exists(basename + RDMStore.EXTENSION):
+            return np.load(basename + RDMStore.EXTENSION, mmap_mode='r' if mmap else None)
+        elif os.path.exists(basename + RDMStore.LEGACY_EXTENSION):
+            return scipydist.squareform(np.loadtxt(basename + RDMStore.LEGACY_EXTENSION), checks=False)
+        else:
+            raise IOError('RDM %s does not exist' % basename)
+
+    @staticmethod
+    def load(basename):
+        '''
+        @return: square RDM
+        '''
+        return scipydist.squareform(RDMStore.load_condensed(basename), checks=False)
+
+    @staticmethod
+    def listing(pattern):
+        '''
+        @param pattern: glob pattern of RDM files without the extension
+        @return:        sorted list of names (without the extension) of the RDMs matching the pattern
+        '''
+        names = set()
+        for extension in [RDMStore.EXTENSION, RDMStore.LEGACY_EXTENSION]:
+            names.update([x[:-len(extension)] for x in glob.glob(pattern + extension)])
+        return sorted(names)
+
+    @staticmethod
+    def convert_directory(directory):
+        '''
+        Convert all text RDMs in the directory into the binary format
+        '''
+        for basename in sorted([x[:-len(RDMStore.LEGACY_EXTENSION)] for x in glob.glob('%s/*%s' % (directory, RDMStore.LEGACY_EXTENSION))]):
+            if not os.path.exists(basename + RDMStore.EXTENSION):
+                print 'Converting %s' % basename
+                RDMStore.save(basename, np.loadtxt(basename + RDMStore.LEGACY_EXTENSION))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert text RDM matrices into the binary format')
+    parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric that was used')
+    args = parser.parse_args()
+    featureset = str(args.featureset)
+    distance = str(args.distance)
+
+    RDMStore.convert_directory('../../Data/RSA/%s.%s/numbers' % (featureset, distance))
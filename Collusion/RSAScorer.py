@@ -1,9 +1,16 @@
 import os
-import glob
+import time
+import resource
+import multiprocessing
 import numpy as np
 import argparse
 from scipy.stats import spearmanr, pearsonr
 from sklearn.preprocessing import MinMaxScaler
+from RDMStore import RDMStore
+from RDM import RDMPixel, RDMDNN, RDMBrain
+from RankCorrelation import RankCorrelation
+from StimulusIndex import StimulusIndex
+from LRUCache import LRUCache
 
 
 class RSAScorer:
@@ -33,22 +40,55 @@ class RSAScorer:
     #: Addition featureset suffix, marks if the RDM were computed on original or shuffled data
     suffix = ''
 
+    #: Whether brain RDMs are computed from the responses on the fly instead of being loaded from disk
+    virtual = False
+
+    #: Floating point type of RDMs and scores: np.float64 or np.float32
+    dtype = np.float64
+
+    #: Whether brain RDMs are masked (see RDMBrain), scores of each of the probes are then computed only on the stimuli
+    #: that were not rejected for that probe
+    masked = False
+
     #: RDMs on DNN layers
     dnn_dsm = {}
 
     #: RDMs on probe responses
     brain_dsm = {}
 
+    #: The same RDMs stacked into [nlayers x nstim x nstim] and [nprobes x nstim x nstim] arrays, dicts hold views of them
+    dnn_dsms = None
+    brain_dsms = None
+
     #: Final results
     scores = None
 
-    def __init__(self, featureset, distance, sid, scope, threshold, network):
+    #: Within- and between-category scores, [nprobes x nlayers x nblocks], and category codes of the blocks
+    block_scores = None
+    blocks = None
+
+    #: Bootstrap confidence intervals of the scores, [nprobes x nlayers] each
+    ci_lower = None
+    ci_upper = None
+
+    def __init__(self, featureset, distance, sid, scope, threshold, network, virtual=False, dtype=np.float64, masked=False,
+                 dnn_dsms=None, brain_dsms=None):
+        '''
+        @param dnn_dsms:   layer RDMs as load_layer_dsms() returns them, None to load them
+        @param brain_dsms: brain RDMs of the subject as load_brain_dsms() returns them, None to load them
+        '''
         self.featureset = featureset
         self.distance = distance
         self.sid = sid
         self.scope = scope
         self.threshold = threshold
         self.network = network
+        self.virtual = virtual
+        self.dtype = dtype
+        self.masked = masked
+        self.suffix = '.masked' if masked else ''
+        self.dnn_dsm = {}
+        self.brain_dsm = {}
 
         # read list of subjects
         self.subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (self.DATADIR, featureset)))
@@ -57,18 +97,19 @@ class RSAScorer:
         #if shuffle:
             #suffix = '.shuffled'
 
-        # load layer RDMs including the "layer 0" (pixel space)
-        for layer in self.layers:
-            if layer == 'pixels':
-                self.dnn_dsm[layer] = np.loadtxt('../../Data/RSA/%s.%s%s/numbers/dnn-%s.txt' % (self.featureset, self.distance, self.suffix, layer))
-            else:
-                self.dnn_dsm[layer] = np.loadtxt('../../Data/RSA/%s.%s%s/numbers/dnn-%s-%s.txt' % (self.featureset, self.distance, self.suffix, layer, self.network))
+        # load layer RDMs including the "layer 0" (pixel space), they are shared between featuresets
+        if dnn_dsms is None:
+            dnn_dsms = self.load_layer_dsms()
+        self.dnn_dsms = dnn_dsms
+        for lid, layer in enumerate(self.layers):
+            self.dnn_dsm[layer] = self.dnn_dsms[lid]
 
-        # load brain response dissimilarity matrices
-        listing = sorted(glob.glob('%s/RSA/%s.%s%s/numbers/brain-%s-*.txt' % (self.DATADIR, self.featureset, self.distance, self.suffix, self.sname)))
-        for pid in range(len(listing)):
-            filename = '%s/RSA/%s.%s%s/numbers/brain-%s-%d.txt' % (self.DATADIR, self.featureset, self.distance, self.suffix, self.sname, pid)
-            self.brain_dsm[pid] = np.loadtxt(filename)
+        # load brain response dissimilarity matrices or compute all of them at once from the responses
+        if brain_dsms is None:
+            brain_dsms = self.load_brain_dsms()
+        self.brain_dsms = brain_dsms
+        for pid in range(self.brain_dsms.shape[0]):
+            self.brain_dsm[pid] = self.brain_dsms[pid]
 
         # create a directory
         self.OUTDIR = '%s/Intracranial/Probe_to_Layer_Maps/rsa_%s.%s%s.%s.%s%s' % (self.DATADIR, self.featureset, self.distance, self.suffix, self.network, self.scope, ('%.10f' % self.threshold)[2:].rstrip('0'))
@@ -78,6 +119,38 @@ class RSAScorer:
             #print 'WARNING: directory %s already exists, make sure we are not overwriting something important there.' % self.OUTDIR
             pass
 
+    def load_layer_dsms(self):
+        '''
+        @return: [nlayers x nstim x nstim] RDMs of the layers in the order of self.layers
+        '''
+        return RSAScorer.read_layer_dsms(self.distance, self.featureset, self.network, self.dtype)
+
+    @staticmethod
+    def read_layer_dsms(distance, featureset, network, dtype=np.float64):
+        '''
+        @return: [nlayers x nstim x nstim] RDMs of the layers in the order of RSAScorer.layers
+        '''
+        pixel_rdm = RDMPixel(distance, featureset, shuffle=False, load_representation=False, dtype=dtype)
+        pixel_rdm.load_dsm()
+        layer_rdm = RDMDNN(distance, network, featureset, shuffle=False, load_representation=False, dtype=dtype)
+        layer_rdm.load_dsm()
+        return np.array([pixel_rdm.dsm if layer == 'pixels' else layer_rdm.dsm[layer] for layer in RSAScorer.layers], dtype=dtype)
+
+    def load_brain_dsms(self):
+        '''
+        @return: [nprobes x nstim x nstim] RDMs of the probes of the subject
+        '''
+        if self.virtual:
+            return RDMBrain(self.distance, self.featureset, self.sid, False, self.dtype, self.masked).compute_batch_dsm()
+        listing = RDMStore.listing('%s/RSA/%s.%s%s/numbers/brain-%s-*' % (self.DATADIR, self.featureset, self.distance, self.suffix, self.sname))
+        if len(listing) == 0:
+            raise Exception('No brain RDMs of %s in %s/RSA/%s.%s%s/numbers, compute them with RDM.py -t brain -a True -d %s -f %s%s '
+                            'or score with --virtual True' % (self.sname, self.DATADIR, self.featureset, self.distance,
+                                                               self.suffix, self.distance, self.featureset,
+                                                               ' --masked True' if self.masked else ''))
+        return np.array([RDMStore.load('%s/RSA/%s.%s%s/numbers/brain-%s-%d' % (self.DATADIR, self.featureset, self.distance, self.suffix, self.sname, pid))
+                         for pid in range(len(listing))], dtype=self.dtype)
+
     @staticmethod
     def compute_one_correlation_score(dnn, brain, scope, threshold):
         '''
@@ -117,13 +190,17 @@ class RSAScorer:
             return score / float(nrows)
 
     def compute_all_correlation_scores(self):
-        nprobes = len(self.brain_dsm)
-        self.scores = np.zeros((nprobes, len(self.layers)))
-        for lid, layer in enumerate(self.layers):
-            for pid in range(nprobes):
-                self.scores[pid, lid] = RSAScorer.compute_one_correlation_score(self.dnn_dsm[layer], self.brain_dsm[pid],
-                                                                                self.scope, self.threshold)
-
+        '''
+        Scores of all probes and layers at once: every RDM is scaled and ranked once and the scores are products of
+        standardized ranks, see RankCorrelation. Same scores as compute_one_correlation_score() gives for each of the
+        pairs. Masked brain RDMs are scored on the stimuli each of the probes kept.
+        '''
+        if self.masked:
+            self.scores = RankCorrelation.masked_scores(self.dnn_dsms, self.brain_dsms, RDMBrain.dsm_masks(self.brain_dsms),
+                                                        self.threshold, self.scope)
+        else:
+            self.scores = RankCorrelation.scores(self.dnn_dsms, self.brain_dsms, self.threshold, self.scope)
+        self.scores = self.scores.astype(self.dtype)
         self.scores[np.isnan(self.scores)] = 0.0
 
         return self.scores
@@ -131,31 +208,279 @@ class RSAScorer:
     def store_all_correlation_scores(self):
         np.savetxt('%s/%s.txt' % (self.OUTDIR, self.sname), self.scores, fmt='%.4f')
 
+    def compute_block_scores(self):
+        '''
+        Scores of all probe-layer pairs within each of the categories and between each pair of them, computed on
+        blocks of the loaded RDMs (which are in category order), see RankCorrelation.block_scores()
+        '''
+        if self.masked:
+            raise Exception('Category block scores are not implemented for masked RDMs')
+        groups = StimulusIndex.load()['category_groups']
+        if len(groups) != self.dnn_dsms.shape[1]:
+            raise Exception('RDMs are on %d stimuli, %d stimuli have a category' % (self.dnn_dsms.shape[1], len(groups)))
+        self.block_scores, self.blocks = RankCorrelation.block_scores(self.dnn_dsms, self.brain_dsms, groups,
+                                                                      self.threshold, self.scope)
+        self.block_scores = self.block_scores.astype(self.dtype)
+        self.block_scores[np.isnan(self.block_scores)] = 0.0
+        return self.block_scores
+
+    def store_block_scores(self):
+        np.savez('%s/%s.blocks.npz' % (self.OUTDIR, self.sname), scores=self.block_scores, blocks=self.blocks,
+                 layers=self.layers)
+
+    def compute_bootstrap_intervals(self, nboot, workers=1, alpha=0.05, seed=0):
+        '''
+        Confidence intervals of the correlations of all probe-layer pairs over stimuli: stimuli (rows and columns of
+        both RDMs) are resampled with replacement nboot times and the samples are scored in chunks by a pool of
+        processes, see RankCorrelation.bootstrap_scores(). Intervals are percentile intervals of the correlations
+        before thresholding.
+
+        @param nboot:   number of bootstrap samples
+        @param workers: number of worker processes
+        @param alpha:   the intervals cover 1 - alpha of the bootstrap distribution
+        @param seed:    seed of the samples
+        '''
+        nstim = self.dnn_dsms.shape[1]
+        samples = np.random.RandomState(seed).randint(0, nstim, size=(nboot, nstim))
+        masks = RDMBrain.dsm_masks(self.brain_dsms) if self.masked else None
+
+        # workers are forked after the RDMs are in place and inherit them instead of receiving a copy
+        bootstrap_data.update({'dnn_dsms': self.dnn_dsms, 'brain_dsms': self.brain_dsms, 'scope': self.scope, 'masks': masks})
+        chunks = np.array_split(samples, min(nboot, workers * 4))
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            scores = np.concatenate(pool.map(compute_bootstrap_chunk, chunks))
+            pool.close()
+            pool.join()
+        else:
+            scores = np.concatenate(map(compute_bootstrap_chunk, chunks))
+        bootstrap_data.clear()
+
+        self.ci_lower = np.nanpercentile(scores, 100.0 * alpha / 2.0, axis=0).astype(self.dtype)
+        self.ci_upper = np.nanpercentile(scores, 100.0 * (1.0 - alpha / 2.0), axis=0).astype(self.dtype)
+        return self.ci_lower, self.ci_upper
+
+    def store_bootstrap_intervals(self):
+        np.savetxt('%s/%s.ci_lower.txt' % (self.OUTDIR, self.sname), self.ci_lower, fmt='%.4f')
+        np.savetxt('%s/%s.ci_upper.txt' % (self.OUTDIR, self.sname), self.ci_upper, fmt='%.4f')
+
     def load_all_correlation_scores(self):
         self.scores = np.loadtxt('%s/%s.txt' % (self.OUTDIR, self.sname))
 
+    @staticmethod
+    def brain_key(featureset, distance, sid, virtual=False, masked=False):
+        '''
+        Key of the brain RDMs of a subject in the cache of score_all_subjects(): the files they are loaded from (the
+        responses with virtual), so featuresets whose files are the same (e.g. symlinked) share one cache entry and a
+        file that is rewritten is loaded again
+
+        @return: tuple of (real path, size, modification time) of each of the files
+        '''
+        subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset)))
+        if virtual:
+            files = ['%s/Intracranial/Processed/%s/%s' % (RSAScorer.DATADIR, featureset, subjects[sid])]
+        else:
+            pattern = '%s/RSA/%s.%s%s/numbers/brain-%s-*' % (RSAScorer.DATADIR, featureset, distance,
+                                                             '.masked' if masked else '', subjects[sid].split('.')[0])
+            files = [name + (RDMStore.EXTENSION if os.path.exists(name + RDMStore.EXTENSION) else RDMStore.LEGACY_EXTENSION)
+                     for name in RDMStore.listing(pattern)]
+            if len(files) == 0:
+                return (pattern,)
+        return (virtual, distance, masked) + tuple((os.path.realpath(f), os.path.getsize(f), os.path.getmtime(f))
+                                                   for f in files)
+
+    @staticmethod
+    def score_all_subjects(featuresets, distance, scopes, thresholds, networks, virtual=False, dtype=np.float64,
+                           masked=False, cache_bytes=1024 * 1024 * 1024, nboot=0, workers=1, blocks=False):
+        '''
+        Score all subjects of all of the featuresets in one process for each combination of network, scope and
+        threshold. Networks are the outer loop, so only the layer RDMs of one network are in memory at a time. Brain
+        RDMs are kept in an LRU cache limited to cache_bytes and keyed by the files they come from (see brain_key()),
+        so as long as they fit they are loaded once per subject for all of the networks, and once for featuresets
+        that share the files. Stores the same per-subject files as separate runs do.
+
+        @param nboot:   number of bootstrap samples for confidence intervals of the scores, 0 to skip them
+        @param workers: number of worker processes for the bootstrap
+        @param blocks:  whether to also store within- and between-category scores
+        @return:        the brain RDM cache, for its statistics
+        '''
+        brain_cache = LRUCache(cache_bytes)
+        for network in networks:
+            layer_dsms = None
+            for featureset in featuresets:
+                subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset)))
+                for sid in range(len(subjects)):
+                    start = time.time()
+                    key = RSAScorer.brain_key(featureset, distance, sid, virtual, masked)
+                    for scope in scopes:
+                        for threshold in thresholds:
+                            brain_dsms = brain_cache.lookup(key)
+                            rsascorer = RSAScorer(featureset, distance, sid, scope, threshold, network, virtual, dtype, masked,
+                                                  layer_dsms, brain_dsms)
+                            layer_dsms = rsascorer.dnn_dsms
+                            if brain_dsms is None:
+                                brain_cache.put(key, rsascorer.brain_dsms)
+                            rsascorer.compute_all_correlation_scores()
+                            rsascorer.store_all_correlation_scores()
+                            if blocks:
+                                rsascorer.compute_block_scores()
+                                rsascorer.store_block_scores()
+                            if nboot > 0:
+                                rsascorer.compute_bootstrap_intervals(nboot, workers)
+                                rsascorer.store_bootstrap_intervals()
+                    print '%s %s %s scored in %.2fs, brain RDM cache: %s' % (network, featureset, subjects[sid], time.time() - start,
+                                                                            brain_cache)
+        return brain_cache
+
+    @staticmethod
+    def score_featuresets(featuresets, distance, sid, scope, threshold, network, dtype=np.float64, masked=False,
+                          layer_dsms=None):
+        '''
+        Score one subject on several featuresets (frequency bands and time windows) in one pass: probe responses of
+        all of the featuresets are stacked, RDMs of all of them are computed with one broadcast and scored against
+        the layer RDMs with one call of RankCorrelation. Stores the usual per-featureset files and a
+        [nfeaturesets x nprobes x nlayers] array of all of the scores.
+
+        @param sid:        ID of the subject in the first of the featuresets, the subject is found by name in the others
+        @param layer_dsms: layer RDMs as load_layer_dsms() returns them, None to load them
+        @return:           the layer RDMs, to be passed on to the next subject
+        '''
+        subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featuresets[0])))
+        sfile = subjects[sid]
+
+        # responses of all of the featuresets side by side, a subject without probes gets one all-zeros probe as in
+        # RDMBrain.compute_batch_dsm()
+        sids, responses = [], []
+        for featureset in featuresets:
+            subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset)))
+            if sfile not in subjects:
+                raise Exception('Subject %s is not in featureset %s' % (sfile, featureset))
+            sids.append(subjects.index(sfile))
+            representation = RDMBrain(distance, featureset, sids[-1], False, dtype, masked).representation
+            if representation.shape[1] == 0:
+                representation = np.zeros((representation.shape[0], 1), dtype=dtype)
+            responses.append(representation)
+        nprobes = [r.shape[1] for r in responses]
+        offsets = np.append(0, np.cumsum(nprobes))
+        stacked = np.hstack(responses).T
+        brain_dsms = np.abs(stacked[:, :, np.newaxis] - stacked[:, np.newaxis, :])
+
+        # one scorer per featureset on views of the stacked RDMs, they all share the layer RDMs
+        scorers = []
+        for fid, featureset in enumerate(featuresets):
+            scorers.append(RSAScorer(featureset, distance, sids[fid], scope, threshold, network, True, dtype, masked,
+                                     layer_dsms, brain_dsms[offsets[fid]:offsets[fid + 1]]))
+            layer_dsms = scorers[-1].dnn_dsms
+
+        if masked:
+            scores = RankCorrelation.masked_scores(layer_dsms, brain_dsms, RDMBrain.dsm_masks(brain_dsms), threshold, scope)
+        else:
+            scores = RankCorrelation.scores(layer_dsms, brain_dsms, threshold, scope)
+        scores = scores.astype(dtype)
+        scores[np.isnan(scores)] = 0.0
+
+        # featuresets can keep different probes of the subject, the array is padded with NaN
+        allscores = np.empty((len(featuresets), max(nprobes), len(RSAScorer.layers)), dtype=dtype)
+        allscores.fill(np.nan)
+        for fid, rsascorer in enumerate(scorers):
+            rsascorer.scores = scores[offsets[fid]:offsets[fid + 1]]
+            rsascorer.store_all_correlation_scores()
+            allscores[fid, :nprobes[fid]] = rsascorer.scores
+
+        outdir = '%s/Intracranial/Probe_to_Layer_Maps/rsa_featuresets.%s%s.%s.%s%s' % (RSAScorer.DATADIR, distance,
+                                                                                         scorers[0].suffix, network, scope,
+                                                                                         ('%.10f' % threshold)[2:].rstrip('0'))
+        try:
+            os.makedirs(outdir)
+        except:
+            pass
+        np.savez('%s/%s.npz' % (outdir, sfile.split('.')[0]), scores=allscores, featuresets=featuresets,
+                 nprobes=nprobes, layers=RSAScorer.layers)
+        return layer_dsms
+
+
+#: RDMs the bootstrap workers score, set before the pool of workers is created
+bootstrap_data = {}
+
+
+def compute_bootstrap_chunk(samples):
+    '''
+    Worker of RSAScorer.compute_bootstrap_intervals(): score one chunk of bootstrap samples
+    '''
+    return RankCorrelation.bootstrap_scores(bootstrap_data['dnn_dsms'], bootstrap_data['brain_dsms'], samples,
+                                            bootstrap_data['scope'], bootstrap_data['masks'])
+
 
 if __name__ == '__main__':
 
     # read in command line arguments
     parser = argparse.ArgumentParser(description='Compute correlation scores between RDM matrices for each probe-layer pair')
-    parser.add_argument('-i', '--sid', dest='sid', type=int, required=True, help='Subject ID')
+    parser.add_argument('-i', '--sid', dest='sid', type=int, required=False, help='Subject ID')
+    parser.add_argument('-a', '--all-subjects', dest='allsubjects', type=str, required=False, default=False, help='Whether to score all subjects in one process instead of one subject (-i), -f, -o, -t and -n can then be comma-separated lists')
+    parser.add_argument('-b', '--bootstrap', dest='bootstrap', type=int, required=False, default=0, help='Number of bootstrap samples of stimuli for confidence intervals of the scores (0 for none)')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, required=False, default=multiprocessing.cpu_count(), help='Number of worker processes for the bootstrap')
+    parser.add_argument('--stacked', dest='stacked', type=str, required=False, default=False, help='Whether to score all of the featuresets of -f (a comma-separated list) in one pass per subject, brain RDMs are computed from the responses')
+    parser.add_argument('--blocks', dest='blocks', type=str, required=False, default=False, help='Whether to also store within- and between-category scores of each probe-layer pair')
+    parser.add_argument('-c', '--cache', dest='cache', type=int, required=False, default=1024, help='Size limit in MB of the brain RDM cache for --all-subjects')
     parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
     parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use')
     parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=True, help='image or matrix depending on which you to compute the correlation on')
     #parser.add_argument('-s', '--shuffle', dest='shuffle', type=bool, required=False, default=False, help='Whether to shuffle data for a permutation test')
-    parser.add_argument('-t', '--threshold', dest='threshold', type=float, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
+    parser.add_argument('-t', '--threshold', dest='threshold', type=str, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
     parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='RDM of activiation of which NN are to be used to compute the scores')
+    parser.add_argument('-v', '--virtual', dest='virtual', type=str, required=False, default=False, help='Whether to compute brain RDMs from the responses instead of loading them from disk')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type of RDMs and scores: float64 or float32')
+    parser.add_argument('--masked', dest='masked', type=str, required=False, default=False, help='Whether to leave stimuli rejected as artifacts out of the scores of each probe (needs brain RDMs computed with --masked True)')
     args = parser.parse_args()
-    sid = int(args.sid)
+    sid = int(args.sid) if args.sid is not None else None
     featureset = str(args.featureset)
     distance = str(args.distance)
     #shuffle = bool(args.shuffle)
     onwhat = str(args.onwhat)
-    threshold = float(args.threshold)
     network = str(args.network)
-
-    rsascorer = RSAScorer(featureset, distance, sid, onwhat, threshold, network)
-    rsascorer.compute_all_correlation_scores()
-    rsascorer.store_all_correlation_scores()
-
+    virtual = bool(args.virtual == 'True')
+    dtype = np.dtype(str(args.precision)).type
+    masked = bool(args.masked == 'True')
+    allsubjects = bool(args.allsubjects == 'True')
+    nboot = int(args.bootstrap)
+    workers = int(args.workers)
+    blocks = bool(args.blocks == 'True')
+    stacked = bool(args.stacked == 'True')
+
+    if stacked:
+        start = time.time()
+        featuresets = featureset.split(',')
+        threshold = float(args.threshold)
+        nsubjects = len(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featuresets[0])))
+        if sid is None and not allsubjects:
+            raise Exception("Subject ID (-i) is a required argument without --all-subjects")
+        layer_dsms = None
+        for s in (range(nsubjects) if allsubjects else [sid]):
+            layer_dsms = RSAScorer.score_featuresets(featuresets, distance, s, onwhat, threshold, network, dtype, masked,
+                                                     layer_dsms)
+        print '%d featuresets scored in %.2fs, peak RSS: %.1f MB' % (len(featuresets), time.time() - start,
+                                                                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+    elif allsubjects:
+        start = time.time()
+        RSAScorer.score_all_subjects(featureset.split(','), distance, onwhat.split(','),
+                                     [float(t) for t in str(args.threshold).split(',')], network.split(','), virtual,
+                                     dtype, masked, int(args.cache) * 1024 * 1024, nboot, workers, blocks)
+        print 'All done in %.2fs, peak RSS: %.1f MB' % (time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+    else:
+        if sid is None:
+            raise Exception("Subject ID (-i) is a required argument without --all-subjects")
+        threshold = float(args.threshold)
+        rsascorer = RSAScorer(featureset, distance, sid, onwhat, threshold, network, virtual, dtype, masked)
+        rsascorer.compute_all_correlation_scores()
+        rsascorer.store_all_correlation_scores()
+        if blocks:
+            rsascorer.compute_block_scores()
+            rsascorer.store_block_scores()
+        if nboot > 0:
+            start = time.time()
+            rsascorer.compute_bootstrap_intervals(nboot, workers)
+            rsascorer.store_bootstrap_intervals()
+            # ru_maxrss is in kilobytes, for the children it is the peak of the largest worker
+            print '%d bootstrap samples in %.2fs with %d workers, peak RSS: %.1f MB, of a worker: %.1f MB' % (
+                nboot, time.time() - start, workers, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
@@ -0,0 +1,344 @@
+import numpy as np
+from scipy.stats import distributions
+
+
+class RankCorrelation:
+    '''
+    Vectorized Spearman correlation between batches of RDMs, computed the way RSAScorer.compute_one_correlation_score
+    computes it for one pair: columns of both RDMs are min-max scaled (as sklearn MinMaxScaler does), the scaled
+    matrices are raveled, ranked with ties averaged and correlated, p-values come from the t distribution with n - 2
+    degrees of freedom (as in scipy.stats.spearmanr).
+
+    Each RDM is scaled and ranked once, correlations of all pairs are then one product of standardized ranks. In the
+    image scope each row of an RDM is ranked on its own and correlations of all rows of all pairs are one einsum.
+
+    Standardized ranks are kept in the floating point type of the RDMs (float32 RDMs give float32 ranks), only the
+    temporaries of ranking one chunk of RDMs are float64.
+    '''
+
+    #: Number of RDMs to rank at once, bounds the memory used by batches of [nstim x nstim] RDMs
+    CHUNK = 64
+
+    #: Fewest stimuli a masked RDM has to keep to be scored, see masked_scores()
+    MIN_STIMULI = 3
+
+    @staticmethod
+    def minmax_columns(squares):
+        '''
+        @param squares: [nrdms x nstim x nstim] batch of RDMs
+        @return:        the RDMs with each of the columns scaled to [0, 1] with exactly the operations MinMaxScaler uses
+        '''
+        squares = np.asarray(squares)
+        data_min = np.min(squares, axis=1)[:, np.newaxis, :]
+        data_range = np.max(squares, axis=1)[:, np.newaxis, :] - data_min
+        data_range[data_range == 0.0] = 1.0
+        scale = 1.0 / data_range
+        return squares * scale + (0.0 - data_min * scale)
+
+    @staticmethod
+    def rank_rows(data):
+        '''
+        Ranks of the values in each of the rows, ties get the average rank (as scipy.stats.rankdata)
+
+        @param data: [nrows x n] array
+        @return:     [nrows x n] float64 ranks starting from 1
+        '''
+        data = np.asarray(data)
+        nrows, n = data.shape
+        offsets = (np.arange(nrows) * n)[:, np.newaxis]
+        order = (np.argsort(data, axis=1) + offsets).ravel()
+        values = data.ravel()[order].reshape((nrows, n))
+
+        # runs of equal values in the sorted rows, a row always starts a new run
+        starts = np.ones((nrows, n), dtype=bool)
+        starts[:, 1:] = values[:, 1:] != values[:, :-1]
+        starts = starts.ravel()
+        runs = np.cumsum(starts) - 1
+        bounds = np.append(np.nonzero(starts)[0], nrows * n)
+
+        # every value of a run gets the average of the sorted positions the run spans
+        average = (bounds[:-1] + bounds[1:] - 1) / 2.0
+        ranks = np.empty(nrows * n)
+        ranks[order] = (average[runs].reshape((nrows, n)) - offsets + 1.0).ravel()
+        return ranks.reshape((nrows, n))
+
+    @staticmethod
+    def standardize_rows(data):
+        '''
+        @return: rows centered and scaled so that the dot product of two rows is their Pearson correlation, constant
+                 rows become NaN
+        '''
+        centered = data - np.mean(data, axis=1)[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return centered / np.sqrt(np.sum(centered ** 2, axis=1))[:, np.newaxis]
+
+    @staticmethod
+    def rank_dtype(squares, dtype=None):
+        '''
+        @return: dtype if it is given, otherwise the floating point type of the RDMs (float64 for any other type)
+        '''
+        if dtype is not None:
+            return dtype
+        dtype = np.asarray(squares).dtype
+        return dtype.type if np.issubdtype(dtype, np.floating) else np.float64
+
+    @staticmethod
+    def ranked_matrices(squares, dtype=None):
+        '''
+        @param squares: [nrdms x nstim x nstim] batch of RDMs
+        @param dtype:   floating point type of the ranks, None for the type of the RDMs
+        @return:        [nrdms x nstim^2] standardized ranks of the min-max scaled, raveled RDMs
+        '''
+        ranked = np.empty((len(squares), np.prod(np.shape(squares)[1:])), dtype=RankCorrelation.rank_dtype(squares, dtype))
+        for start in range(0, len(squares), RankCorrelation.CHUNK):
+            scaled = RankCorrelation.minmax_columns(squares[start:start + RankCorrelation.CHUNK])
+            ranks = RankCorrelation.rank_rows(scaled.reshape((scaled.shape[0], -1)))
+            ranked[start:start + RankCorrelation.CHUNK] = RankCorrelation.standardize_rows(ranks)
+        return ranked
+
+    @staticmethod
+    def ranked_rows(squares, dtype=None):
+        '''
+        @param squares: [nrdms x nstim x nstim] batch of RDMs
+        @param dtype:   floating point type of the ranks, None for the type of the RDMs
+        @return:        [nrdms x nstim x nstim] standardized ranks of each of the rows of the min-max scaled RDMs
+        '''
+        ranked = np.empty(np.shape(squares), dtype=RankCorrelation.rank_dtype(squares, dtype))
+        for start in range(0, len(squares), RankCorrelation.CHUNK):
+            scaled = RankCorrelation.minmax_columns(squares[start:start + RankCorrelation.CHUNK])
+            ranks = RankCorrelation.rank_rows(scaled.reshape((-1, scaled.shape[2])))
+            ranked[start:start + RankCorrelation.CHUNK] = RankCorrelation.standardize_rows(ranks).reshape(scaled.shape)
+        return ranked
+
+    @staticmethod
+    def ranked(squares, scope, dtype=None):
+        '''
+        @return: standardized ranks of the RDMs for the scope, see ranked_matrices() and ranked_rows()
+        '''
+        if scope == 'matrix':
+            return RankCorrelation.ranked_matrices(squares, dtype)
+        if scope == 'image':
+            return RankCorrelation.ranked_rows(squares, dtype)
+        raise Exception('Unknown scope %s' % scope)
+
+    @staticmethod
+    def pvalues(r, n):
+        '''
+        @param r: correlation coefficients
+        @param n: number of observations each of them was computed on
+        @return:  two-sided p-values of the coefficients as scipy.stats.spearmanr computes them
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = r * np.sqrt((n - 2) / ((r + 1.0) * (1.0 - r)))
+            return 2 * distributions.t.sf(np.abs(t), n - 2)
+
+    @staticmethod
+    def apply_threshold(r, p, threshold):
+        '''
+        Keep only significant positive scores if threshold is below 1.0, otherwise keep all of them
+        '''
+        if threshold < 1.0:
+            with np.errstate(invalid='ignore'):
+                return np.where((r > 0.0) & (p <= threshold), r, 0.0)
+        return r
+
+    @staticmethod
+    def matrix_scores(layer_dsms, brain_dsms, threshold):
+        '''
+        Whole-matrix scores of all of the brain RDMs against all of the layer RDMs
+
+        @param layer_dsms: [nlayers x nstim x nstim] layer RDMs
+        @param brain_dsms: [nprobes x nstim x nstim] brain RDMs
+        @param threshold:  significance threshold, 1.0 to keep all of the scores
+        @return:           [nprobes x nlayers] scores, NaN where a correlation is undefined
+        '''
+        return RankCorrelation.ranked_scores(RankCorrelation.ranked_matrices(layer_dsms),
+                                             RankCorrelation.ranked_matrices(brain_dsms), threshold, 'matrix')
+
+    @staticmethod
+    def image_scores(layer_dsms, brain_dsms, threshold):
+        '''
+        Image-by-image scores of all of the brain RDMs against all of the layer RDMs: row i of a brain RDM is
+        correlated with row i of a layer RDM, the significant (or all, if the threshold is 1.0) row correlations are
+        summed up and divided by the number of rows
+
+        @return: [nprobes x nlayers] scores, NaN where a correlation is undefined and the threshold is 1.0
+        '''
+        return RankCorrelation.ranked_scores(RankCorrelation.ranked_rows(layer_dsms),
+                                             RankCorrelation.ranked_rows(brain_dsms), threshold, 'image')
+
+    @staticmethod
+    def ranked_scores(layer_ranks, brain_ranks, threshold, scope):
+        '''
+        Scores of RDMs that are already ranked, so that ranks of the layer RDMs can be reused across many batches of
+        brain RDMs
+
+        @param layer_ranks: ranked() of the layer RDMs
+        @param brain_ranks: ranked() of the brain RDMs
+        @return:            [nprobes x nlayers] scores
+        '''
+        if scope == 'matrix':
+            r = np.dot(brain_ranks, layer_ranks.T)
+            return RankCorrelation.apply_threshold(r, RankCorrelation.pvalues(r, layer_ranks.shape[1]), threshold)
+        if scope == 'image':
+            r = np.einsum('pij,lij->pli', brain_ranks, layer_ranks)
+            r = RankCorrelation.apply_threshold(r, RankCorrelation.pvalues(r, layer_ranks.shape[2]), threshold)
+            return np.sum(r, axis=2) / float(layer_ranks.shape[1])
+        raise Exception('Unknown scope %s' % scope)
+
+    @staticmethod
+    def scores(layer_dsms, brain_dsms, threshold, scope):
+        '''
+        @param scope: 'matrix' or 'image', see RSAScorer.compute_one_correlation_score()
+        '''
+        if scope == 'matrix':
+            return RankCorrelation.matrix_scores(layer_dsms, brain_dsms, threshold)
+        if scope == 'image':
+            return RankCorrelation.image_scores(layer_dsms, brain_dsms, threshold)
+        raise Exception('Unknown scope %s' % scope)
+
+    @staticmethod
+    def category_blocks(groups):
+        '''
+        Blocks of an RDM in category order: one within-category block on the diagonal for each of the categories and
+        one between-category block above the diagonal for each pair of them
+
+        @param groups: category code of each of the stimuli in category order, each category is one run of stimuli
+        @return:       (ranges, blocks), ranges is a list of (start, end) rows of each of the categories, blocks is an
+                       [nblocks x 2] array of pairs of indices into ranges, within-category blocks go first
+        '''
+        groups = np.asarray(groups)
+        starts = np.append(0, np.nonzero(groups[1:] != groups[:-1])[0] + 1)
+        if len(np.unique(groups)) != len(starts):
+            raise Exception('Stimuli of a category are not contiguous, RDMs are expected in category order')
+        ends = np.append(starts[1:], len(groups))
+        ncat = len(starts)
+        within = [(a, a) for a in range(ncat)]
+        between = [(a, b) for a in range(ncat) for b in range(a + 1, ncat)]
+        return zip(starts, ends), np.array(within + between)
+
+    @staticmethod
+    def ranked_blocks(squares, ranges, blocks, scope):
+        '''
+        Each of the RDMs is min-max scaled as a whole (as for matrix_scores()) and ranked block by block: the blocks
+        are views of the scaled RDMs, each of them raveled and ranked (scope 'matrix') or ranked row by row (scope
+        'image')
+
+        @param squares: [nrdms x nstim x nstim] batch of RDMs in category order
+        @return:        list of standardized ranks per block, [nrdms x block size] or [nrdms x block rows x block columns]
+        '''
+        ranked = []
+        dtype = RankCorrelation.rank_dtype(squares)
+        for a, b in blocks:
+            shape = (ranges[a][1] - ranges[a][0], ranges[b][1] - ranges[b][0])
+            ranked.append(np.empty((len(squares), shape[0] * shape[1]) if scope == 'matrix' else (len(squares),) + shape,
+                                   dtype=dtype))
+        for start in range(0, len(squares), RankCorrelation.CHUNK):
+            scaled = RankCorrelation.minmax_columns(squares[start:start + RankCorrelation.CHUNK])
+            for j, (a, b) in enumerate(blocks):
+                block = scaled[:, ranges[a][0]:ranges[a][1], ranges[b][0]:ranges[b][1]]
+                if scope == 'matrix':
+                    ranks = RankCorrelation.rank_rows(block.reshape((block.shape[0], -1)))
+                    ranked[j][start:start + RankCorrelation.CHUNK] = RankCorrelation.standardize_rows(ranks)
+                else:
+                    ranks = RankCorrelation.rank_rows(block.reshape((-1, block.shape[2])))
+                    ranked[j][start:start + RankCorrelation.CHUNK] = RankCorrelation.standardize_rows(ranks).reshape(block.shape)
+        return ranked
+
+    @staticmethod
+    def block_scores(layer_dsms, brain_dsms, groups, threshold, scope):
+        '''
+        Within- and between-category scores of all of the brain RDMs against all of the layer RDMs: the same scores
+        as scores() gives, computed on each of the blocks of category_blocks() instead of the whole RDMs. All RDMs
+        are scaled once and each block of each RDM is ranked once.
+
+        @param groups: category code of each of the stimuli, RDMs are in category order
+        @return:       ([nprobes x nlayers x nblocks] scores, [nblocks x 2] category codes of each of the blocks)
+        '''
+        ranges, blocks = RankCorrelation.category_blocks(groups)
+        layer_ranks = RankCorrelation.ranked_blocks(layer_dsms, ranges, blocks, scope)
+        brain_ranks = RankCorrelation.ranked_blocks(brain_dsms, ranges, blocks, scope)
+        scores = np.empty((len(brain_dsms), len(layer_dsms), len(blocks)))
+        for j in range(len(blocks)):
+            if scope == 'matrix':
+                r = np.dot(brain_ranks[j], layer_ranks[j].T)
+                scores[:, :, j] = RankCorrelation.apply_threshold(r, RankCorrelation.pvalues(r, layer_ranks[j].shape[1]), threshold)
+            else:
+                r = np.einsum('pij,lij->pli', brain_ranks[j], layer_ranks[j])
+                r = RankCorrelation.apply_threshold(r, RankCorrelation.pvalues(r, layer_ranks[j].shape[2]), threshold)
+                scores[:, :, j] = np.sum(r, axis=2) / float(layer_ranks[j].shape[1])
+        starts = [start for start, _ in ranges]
+        return scores, np.asarray(groups)[starts][blocks]
+
+    @staticmethod
+    def bootstrap_scores(layer_dsms, brain_dsms, samples, scope, masks=None):
+        '''
+        Scores on bootstrap samples of stimuli: for each of the samples rows and columns of all of the RDMs are taken by
+        the index array of the sample and the resampled RDMs are scored as they are. Samples are processed in batches of
+        about CHUNK resampled RDMs, each batch is one gather of all of the RDMs and is ranked at once. Masked RDMs are
+        scored sample by sample with masked_scores(), the stimuli each of the probes keeps differ between samples.
+
+        @param samples: [nsamples x nstim] indices of stimuli drawn with replacement
+        @param masks:   [nprobes x nstim] masks of the brain RDMs (see masked_scores()), None if they are not masked
+        @return:        [nsamples x nprobes x nlayers] correlations (without thresholding)
+        '''
+        layer_dsms = np.asarray(layer_dsms)
+        brain_dsms = np.asarray(brain_dsms)
+        samples = np.asarray(samples)
+        scores = np.empty((len(samples), len(brain_dsms), len(layer_dsms)))
+        if masks is not None:
+            for b, sample in enumerate(samples):
+                rows, columns = sample[:, np.newaxis], sample[np.newaxis, :]
+                scores[b] = RankCorrelation.masked_scores(layer_dsms[:, rows, columns], brain_dsms[:, rows, columns],
+                                                          masks[:, sample], 1.0, scope)
+            return scores
+
+        nlayers, nprobes, nstim = len(layer_dsms), len(brain_dsms), layer_dsms.shape[1]
+        layer_flat = layer_dsms.reshape((nlayers, -1))
+        brain_flat = brain_dsms.reshape((nprobes, -1))
+        batch = max(1, RankCorrelation.CHUNK // (nlayers + nprobes))
+        for start in range(0, len(samples), batch):
+            sample = samples[start:start + batch]
+            indices = sample[:, :, np.newaxis] * nstim + sample[:, np.newaxis, :]
+
+            # [nrdms x nbatch x nstim x nstim] resampled RDMs, ranked as one [nrdms * nbatch] batch
+            shape = (-1,) + indices.shape[1:]
+            layer_ranks = RankCorrelation.ranked(np.take(layer_flat, indices, axis=1).reshape(shape), scope)
+            brain_ranks = RankCorrelation.ranked(np.take(brain_flat, indices, axis=1).reshape(shape), scope)
+            layer_ranks = layer_ranks.reshape((nlayers, len(sample), -1))
+            brain_ranks = brain_ranks.reshape((nprobes, len(sample), -1))
+
+            # in the image scope the sum over all of the values is the sum of the row correlations
+            r = np.matmul(brain_ranks.transpose((1, 0, 2)), layer_ranks.transpose((1, 2, 0)))
+            scores[start:start + len(sample)] = r if scope == 'matrix' else r / float(indices.shape[1])
+        return scores
+
+    @staticmethod
+    def masked_scores(layer_dsms, brain_dsms, masks, threshold, scope):
+        '''
+        Pairwise-complete scores: each of the brain RDMs is correlated with the layer RDMs only on the stimuli its
+        mask keeps (in the image scope only the kept rows are averaged). Brain RDMs that share a mask are scored
+        together, layer RDMs are restricted to the mask, scaled and ranked once per mask. Probes whose mask keeps fewer
+        than MIN_STIMULI stimuli (e.g. all of their stimuli were rejected) have no defined correlation and get NaN
+        scores, as other undefined correlations do.
+
+        @param layer_dsms: [nlayers x nstim x nstim] layer RDMs
+        @param brain_dsms: [nprobes x nstim x nstim] brain RDMs, values of rejected stimuli are ignored
+        @param masks:      [nprobes x nstim] boolean, which stimuli of each of the probes to keep
+        @param threshold:  significance threshold, 1.0 to keep all of the scores
+        @param scope:      'matrix' or 'image'
+        @return:           [nprobes x nlayers] scores
+        '''
+        layer_dsms = np.asarray(layer_dsms)
+        brain_dsms = np.asarray(brain_dsms)
+        scores = np.zeros((len(brain_dsms), len(layer_dsms)))
+        patterns, groups = np.unique(np.asarray(masks, dtype=bool), axis=0, return_inverse=True)
+        for g, pattern in enumerate(patterns):
+            keep = np.where(pattern)[0]
+            probes = np.where(groups == g)[0]
+            if len(keep) < RankCorrelation.MIN_STIMULI:
+                scores[probes] = np.nan
+                continue
+            scores[probes] = RankCorrelation.scores(layer_dsms[:, keep][:, :, keep],
+                                                    brain_dsms[probes][:, keep][:, :, keep], threshold, scope)
+        return scores
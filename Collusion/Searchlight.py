@@ -0,0 +1,178 @@
+import os
+import time
+import resource
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from RDM import RDMBrain
+from RSAScorer import RSAScorer
+from RankCorrelation import RankCorrelation
+
+
+class Searchlight:
+    '''
+    Searchlight RSA in MNI space: probes of all of the subjects of a featureset are pooled, every probe is the center
+    of a searchlight of the probes within a radius of it (from any subject, stimuli are in the same category order
+    for all of them) and the Euclidean RDM of the responses of the whole searchlight is scored against each layer.
+
+    Neighborhoods of all radii come from one query of a KD-tree over the probe coordinates, searchlight RDMs are built
+    for chunks of centers at once and layer RDMs are ranked once for all radii.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    OUTDIR = None
+
+    #: Paramters to compute on
+    featureset = None
+    distance = None
+    network = None
+    scope = None
+    threshold = None
+    dtype = np.float64
+
+    #: Memory budget in bytes for the searchlight RDMs of one chunk of centers
+    max_memory = None
+
+    #: Responses of all of the probes of all of the subjects, [nstim x nprobes] in category order
+    responses = None
+
+    #: MNI coordinates of the probes, [nprobes x 3]
+    mni = None
+
+    #: Subject name and probe ID of each of the probes
+    snames = None
+    pids = None
+
+    #: RDMs on DNN layers, [nlayers x nstim x nstim]
+    dnn_dsms = None
+
+    #: Results: radius -> [nprobes x nlayers] scores and radius -> number of probes in each of the searchlights
+    scores = None
+    sizes = None
+
+    def __init__(self, featureset, distance, network, scope, threshold, dtype=np.float64, max_memory=512 * 1024 * 1024):
+        self.featureset = featureset
+        self.distance = distance
+        self.network = network
+        self.scope = scope
+        self.threshold = threshold
+        self.dtype = dtype
+        self.max_memory = max_memory
+        self.scores = {}
+        self.sizes = {}
+
+        self.load_probes()
+        self.dnn_dsms = RSAScorer.read_layer_dsms(distance, featureset, network, dtype)
+
+        self.OUTDIR = '%s/Intracranial/Probe_to_Layer_Maps/searchlight_%s.%s.%s.%s%s' % (self.DATADIR, self.featureset, self.distance, self.network, self.scope, ('%.10f' % self.threshold)[2:].rstrip('0'))
+        try:
+            os.makedirs(self.OUTDIR)
+        except:
+            pass
+
+    def load_probes(self):
+        '''
+        Collect responses and coordinates of the probes of all of the subjects
+        '''
+        pooled = RDMBrain.pool_subjects(self.distance, self.featureset, self.dtype)
+        self.responses = pooled['responses']
+        self.mni = pooled['mni']
+        self.snames = pooled['names']
+        self.pids = pooled['pids']
+
+    @staticmethod
+    def neighborhoods(mni, radii):
+        '''
+        Probes within each of the radii of each of the probes, the probe itself included
+
+        @param mni:   [nprobes x 3] coordinates
+        @param radii: list of radii
+        @return:      dict radius -> [nprobes x max searchlight size] indices of the neighbors of each of the probes
+                      padded with nprobes
+        '''
+        nprobes = len(mni)
+        pairs = cKDTree(mni).query_pairs(max(radii), output_type='ndarray')
+        distances = np.sqrt(np.sum((mni[pairs[:, 0]] - mni[pairs[:, 1]]) ** 2, axis=1))
+
+        # pairs go both ways, every probe is its own neighbor
+        centers = np.concatenate([np.arange(nprobes), pairs[:, 0], pairs[:, 1]])
+        members = np.concatenate([np.arange(nprobes), pairs[:, 1], pairs[:, 0]])
+        distances = np.concatenate([np.zeros(nprobes), distances, distances])
+
+        neighbors = {}
+        for radius in radii:
+            keep = distances <= radius
+            order = np.lexsort((members[keep], centers[keep]))
+            center, member = centers[keep][order], members[keep][order]
+            counts = np.bincount(center, minlength=nprobes)
+            slots = np.arange(len(center)) - np.repeat(np.cumsum(counts) - counts, counts)
+            neighbors[radius] = np.full((nprobes, counts.max()), nprobes, dtype=np.int64)
+            neighbors[radius][center, slots] = member
+        return neighbors
+
+    def searchlight_dsms(self, neighbors):
+        '''
+        Euclidean RDMs of the responses of searchlights, accumulated over the slots of the padded neighborhoods (padding
+        refers to a probe with zero responses, which adds nothing to the distances)
+
+        @param neighbors: [ncenters x searchlight size] rows of neighborhoods()
+        @return:          [ncenters x nstim x nstim] RDMs
+        '''
+        nstim = self.responses.shape[0]
+        padded = np.hstack([self.responses, np.zeros((nstim, 1), dtype=self.responses.dtype)])
+        dsms = np.zeros((len(neighbors), nstim, nstim), dtype=self.dtype)
+        for slot in range(neighbors.shape[1]):
+            x = padded[:, neighbors[:, slot]].T
+            dsms += (x[:, :, np.newaxis] - x[:, np.newaxis, :]) ** 2
+        return np.sqrt(dsms)
+
+    def compute_scores(self, radii):
+        '''
+        Score searchlights of all of the probes for each of the radii
+        '''
+        nstim = self.responses.shape[0]
+        layer_ranks = RankCorrelation.ranked(self.dnn_dsms, self.scope)
+
+        # searchlight RDMs, their ranks and the temporary of the accumulation
+        chunk = max(1, int(self.max_memory / (3 * nstim * nstim * 8)))
+
+        for radius, neighbors in sorted(Searchlight.neighborhoods(self.mni, radii).items()):
+            start = time.time()
+            scores = np.empty((len(neighbors), len(self.dnn_dsms)))
+            for first in range(0, len(neighbors), chunk):
+                brain_ranks = RankCorrelation.ranked(self.searchlight_dsms(neighbors[first:first + chunk]), self.scope)
+                scores[first:first + chunk] = RankCorrelation.ranked_scores(layer_ranks, brain_ranks, self.threshold, self.scope)
+            scores[np.isnan(scores)] = 0.0
+            self.scores[radius] = scores.astype(self.dtype)
+            self.sizes[radius] = np.sum(neighbors < len(neighbors), axis=1)
+            print 'Radius %g: %d searchlights of %.1f probes on average scored in %.2fs' % (radius, len(neighbors),
+                                                                                          np.mean(self.sizes[radius]),
+                                                                                          time.time() - start)
+
+    def store_scores(self):
+        for radius in sorted(self.scores.keys()):
+            np.savez('%s/radius%g.npz' % (self.OUTDIR, radius), scores=self.scores[radius], sizes=self.sizes[radius],
+                     mni=self.mni, subjects=self.snames, pids=self.pids, layers=RSAScorer.layers)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Score searchlights of probes in MNI space against each layer')
+    parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+    parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric layer RDMs were computed with')
+    parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=True, help='image or matrix depending on which you to compute the correlation on')
+    parser.add_argument('-t', '--threshold', dest='threshold', type=float, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
+    parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='RDM of activiation of which NN are to be used to compute the scores')
+    parser.add_argument('-r', '--radii', dest='radii', type=str, required=True, help='Comma-separated list of searchlight radii in mm')
+    parser.add_argument('-m', '--max-memory', dest='maxmemory', type=int, required=False, default=512, help='Memory budget in MB for searchlight RDMs of a chunk of centers')
+    parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64', help='Floating point type of RDMs and scores: float64 or float32')
+    args = parser.parse_args()
+    radii = [float(r) for r in str(args.radii).split(',')]
+
+    start = time.time()
+    searchlight = Searchlight(str(args.featureset), str(args.distance), str(args.network), str(args.onwhat),
+                              float(args.threshold), np.dtype(str(args.precision)).type, int(args.maxmemory) * 1024 * 1024)
+    searchlight.compute_scores(radii)
+    searchlight.store_scores()
+    print 'All done in %.2fs, peak RSS: %.1f MB' % (time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
@@ -0,0 +1,110 @@
+import numpy as np
+import scipy.sparse
+from scipy.stats import spearmanr
+from scipy.spatial import distance as scipydist
+from GramRDM import GramRDM
+
+
+class SketchRDM:
+    '''
+    Johnson-Lindenstrauss random projection of a representation to k dimensions.
+
+    Distances between the projected stimuli approximate the distances between the original ones, so an approximate
+    RDM of a 290k-dimensional layer costs as much as an exact RDM of a k-dimensional one. The projection matrix is
+    generated block by block of BLOCK features from the seed and the block number, so it never exists as a whole and
+    it does not depend on whether the representation is projected from memory or read from disk chunk by chunk.
+    '''
+
+    #: Number of features per block of the projection matrix
+    BLOCK = 4096
+
+    #: Kinds of projections: dense Gaussian or very sparse {-1, 0, +1} (Li, Hastie and Church, 2006)
+    KINDS = ['gaussian', 'sparse']
+
+    #: Sketch parameters
+    k = None
+    kind = None
+    seed = None
+
+    #: Number of features of the representation being projected, sets the density of the sparse projection
+    total_features = None
+
+    def __init__(self, k, kind='gaussian', seed=0):
+        if kind not in SketchRDM.KINDS:
+            raise Exception('Unknown kind of projection %s' % kind)
+        self.k = k
+        self.kind = kind
+        self.seed = seed
+
+    def __str__(self):
+        return '%s%d-%d' % (self.kind, self.k, self.seed)
+
+    def projection_block(self, block, nfeatures):
+        '''
+        @param block:     number of the block
+        @param nfeatures: number of features in this block
+        @return:          [nfeatures x k] part of the projection matrix
+        '''
+        rng = np.random.RandomState([self.seed, block])
+        if self.kind == 'gaussian':
+            return rng.randn(nfeatures, self.k) / np.sqrt(self.k)
+
+        # very sparse projection: each entry is non-zero with probability 1/s, s = sqrt(total number of features)
+        s = np.sqrt(self.total_features)
+        u = rng.rand(nfeatures, self.k)
+        signs = (u < 0.5 / s).astype(np.float64) - (u > 1.0 - 0.5 / s).astype(np.float64)
+        return scipy.sparse.csc_matrix(signs * np.sqrt(s / self.k))
+
+    def project(self, representation, rows=None, center=False):
+        '''
+        @param representation: [n x nfeatures] array or path to an .npy file with it
+        @param rows:           indices of the rows (stimuli) to project, None for all of the rows
+        @param center:         project the rows centered on their means (for correlation distance), the means are
+                               subtracted after the projection, so the data is still read only once
+        @return:               [len(rows) x k] projected representation
+        '''
+        if isinstance(representation, str):
+            shape, _, _ = GramRDM.read_header(representation)
+        else:
+            shape = representation.shape
+        rows = np.arange(shape[0]) if rows is None else np.asarray(rows)
+        self.total_features = shape[1]
+
+        projected = np.zeros((len(rows), self.k))
+        sums = np.zeros(len(rows))
+        projected_ones = np.zeros(self.k)
+        for block, start in enumerate(range(0, shape[1], SketchRDM.BLOCK)):
+            stop = min(start + SketchRDM.BLOCK, shape[1])
+            if isinstance(representation, str):
+                data = GramRDM.read_block(representation, rows, start, stop)
+            else:
+                data = representation[:, start:stop][rows]
+            data = np.asarray(data, dtype=np.float64)
+            matrix = self.projection_block(block, stop - start)
+            if scipy.sparse.issparse(matrix):
+                projected += np.asarray((matrix.T * data.T).T)
+            else:
+                projected += np.dot(data, matrix)
+            sums += np.sum(data, axis=1)
+            projected_ones += np.asarray(matrix.sum(axis=0)).ravel()
+
+        if center:
+            projected -= np.outer(sums / float(shape[1]), projected_ones)
+        return projected
+
+    @staticmethod
+    def compare(approximate, exact):
+        '''
+        Compare an approximate RDM to the exact one computed on the same stimuli
+
+        @param approximate: square approximate RDM
+        @param exact:       square exact RDM
+        @return:            dictionary with mean and max distortion |approximate / exact - 1| over the pairs of
+                            stimuli and Spearman correlation between the two RDMs
+        '''
+        approximate = scipydist.squareform(approximate, checks=False)
+        exact = scipydist.squareform(exact, checks=False)
+        nonzero = exact > 0.0
+        distortion = np.abs(approximate[nonzero] / exact[nonzero] - 1.0)
+        return {'distortion_mean': np.mean(distortion), 'distortion_max': np.max(distortion),
+                'spearman': spearmanr(approximate, exact)[0]}
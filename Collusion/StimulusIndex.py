@@ -0,0 +1,131 @@
+import os
+import numpy as np
+from RDMStore import RDMStore
+
+
+class StimulusIndex:
+    '''
+    All of the stimulus orderings as integer arrays, computed once and persisted next to the stimulus tensor.
+
+    There are three orderings of the stimuli: the order they were presented to the DNN (DNN/imagesdone.txt), the
+    order they were presented to the subjects (stimsequence.txt) and the order by category (sorted by name), which is
+    the order of the rows and columns of all RDMs. The index maps between them with arrays that can be used directly
+    for fancy indexing, see take().
+
+    The index is rebuilt when one of the stimulus lists is newer than the persisted index, it is written to a
+    temporary file and renamed into place so that jobs reading it at the same time never see a truncated file.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    INDEXDIR = '%s/DNN/stimuli' % DATADIR
+    STIMSEQUENCE = '../Intracranial/stimsequence.txt'
+    STIMGROUPS = '../Intracranial/stimgroups.txt'
+
+    #: The index, loaded once per process
+    index = None
+
+    @staticmethod
+    def path():
+        return '%s/index.npz' % StimulusIndex.INDEXDIR
+
+    @staticmethod
+    def sources():
+        return ['%s/DNN/imagesdone.txt' % StimulusIndex.DATADIR, StimulusIndex.STIMSEQUENCE, StimulusIndex.STIMGROUPS]
+
+    @staticmethod
+    def build():
+        '''
+        @return: dictionary with
+                 dnn_stimuli:                       names of the stimuli in DNN order
+                 stimulation_stimuli:               names of the stimuli in stimulation order
+                 stimulation_groups:                category codes of the stimuli in stimulation order
+                 reorder_stimulation_to_categories: rows of data in stimulation order to take to get category order
+                 reorder_dnn_to_categories:         rows of data in DNN order to take to get category order
+                 category_stimuli:                  names of the stimuli in category order
+                 category_groups:                   category codes of the stimuli in category order
+        '''
+        dnn_stimuli = np.loadtxt('%s/DNN/imagesdone.txt' % StimulusIndex.DATADIR, dtype={'names': ('stimulus', 'class'), 'formats': ('S10', 'i1')})
+        dnn_stimuli = np.array([x[0].split('.')[0] for x in dnn_stimuli])
+        stimulation_stimuli = np.loadtxt(StimulusIndex.STIMSEQUENCE, dtype='string')
+        stimulation_groups = np.loadtxt(StimulusIndex.STIMGROUPS, dtype=np.int64)
+
+        # stable sort keeps repeated presentations of a stimulus in the order they were shown
+        reorder_stimulation_to_categories = np.argsort(stimulation_stimuli, kind='mergesort')
+        category_stimuli = stimulation_stimuli[reorder_stimulation_to_categories]
+
+        # DNN row of each of the stimuli in category order, stimuli the DNN has not seen are left out
+        reorder_dnn_to_categories = StimulusIndex.lookup(dnn_stimuli, category_stimuli)
+        reorder_dnn_to_categories = reorder_dnn_to_categories[reorder_dnn_to_categories >= 0]
+
+        return {'dnn_stimuli': dnn_stimuli,
+                'stimulation_stimuli': stimulation_stimuli,
+                'stimulation_groups': stimulation_groups,
+                'reorder_stimulation_to_categories': reorder_stimulation_to_categories,
+                'reorder_dnn_to_categories': reorder_dnn_to_categories,
+                'category_stimuli': category_stimuli,
+                'category_groups': stimulation_groups[reorder_stimulation_to_categories]}
+
+    @staticmethod
+    def load():
+        '''
+        @return: the index (see build()), read from disk or built and persisted if it is missing or out of date
+        '''
+        if StimulusIndex.index is not None:
+            return StimulusIndex.index
+
+        path = StimulusIndex.path()
+        if os.path.exists(path) and all(os.path.getmtime(f) <= os.path.getmtime(path) for f in StimulusIndex.sources()):
+            stored = np.load(path)
+            StimulusIndex.index = dict([(key, stored[key]) for key in stored.files])
+        else:
+            StimulusIndex.index = StimulusIndex.build()
+            try:
+                os.makedirs(StimulusIndex.INDEXDIR)
+            except:
+                pass
+            RDMStore.atomic_write(path, lambda f: np.savez(f, **StimulusIndex.index))
+
+        return StimulusIndex.index
+
+    @staticmethod
+    def lookup(names, stimuli):
+        '''
+        Vectorized names.index() for each of the stimuli
+
+        @param names:   array of unique names
+        @param stimuli: names to look up
+        @return:        int64 array of positions of the stimuli in names, -1 for the ones that are not there
+        '''
+        names = np.asarray(names)
+        stimuli = np.asarray(stimuli)
+        order = np.argsort(names, kind='mergesort')
+        if len(names) > 1 and np.any(names[order][1:] == names[order][:-1]):
+            raise Exception('Stimulus names are not unique')
+        positions = np.minimum(np.searchsorted(names[order], stimuli), len(names) - 1)
+        found = names[order][positions] == stimuli
+        return np.where(found, order[positions], -1)
+
+    @staticmethod
+    def dnn_rows(stimseq):
+        '''
+        @param stimseq: names of the stimuli in the order they were shown to a subject
+        @return:        DNN rows of those stimuli, so activations[dnn_rows(stimseq)] is aligned with the subject data
+        '''
+        rows = StimulusIndex.lookup(StimulusIndex.load()['dnn_stimuli'], stimseq)
+        if np.any(rows < 0):
+            raise Exception('Stimuli %s were not presented to the DNN' % ', '.join(np.asarray(stimseq)[rows < 0]))
+        return rows
+
+    @staticmethod
+    def take(data, ordering, axis=0, out=None):
+        '''
+        Reorder data with one of the orderings of the index. If the ordering does not change anything the data itself
+        is returned, otherwise the rows are gathered with one np.take (into out if given, to reuse a buffer).
+
+        @param ordering: name of an ordering of the index, e.g. 'reorder_dnn_to_categories', or an array of rows
+        '''
+        rows = StimulusIndex.load()[ordering] if isinstance(ordering, str) else np.asarray(ordering)
+        if out is None and len(rows) == data.shape[axis] and np.array_equal(rows, np.arange(len(rows))):
+            return data
+        return np.take(data, rows, axis=axis, out=out)
@@ -0,0 +1,132 @@
+import os
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from PIL import Image
+from RDMStore import RDMStore
+from StimulusIndex import StimulusIndex
+
+
+class StimulusTensor:
+    '''
+    Decoded stimulus images stacked into one [nstim x 51529] uint8 .npy file (one 227x227 grayscale image per row,
+    in the order of DNN/imagesdone.txt) with the list of stimulus names next to it.
+
+    Images are decoded once, in parallel, and consumers memory-map the tensor instead of decoding 419 JPEGs on every
+    run. Rows of the tensor are read in place: load() returns a read-only memory map and path() can be given to
+    GramRDM.read_block() to read chunks of it.
+
+    The tensor is built in a temporary file that is renamed into place when it is complete, so jobs that start at the
+    same time and all build it never read a half-written tensor.
+    '''
+
+    #: Paths
+    DATADIR = '../../Data'
+    TENSORDIR = '%s/DNN/stimuli' % DATADIR
+
+    #: Size images are resized to, as expected by the DNN
+    SIZE = (227, 227)
+
+    @staticmethod
+    def path():
+        return '%s/pixels.npy' % StimulusTensor.TENSORDIR
+
+    @staticmethod
+    def names_path():
+        return '%s/names.txt' % StimulusTensor.TENSORDIR
+
+    @staticmethod
+    def exists():
+        return os.path.exists(StimulusTensor.path()) and os.path.exists(StimulusTensor.names_path())
+
+    @staticmethod
+    def stimulus_names():
+        '''
+        @return: names of the stimuli (without extension) in the order they were presented to the DNN
+        '''
+        return StimulusIndex.load()['dnn_stimuli']
+
+    @staticmethod
+    def build(workers=multiprocessing.cpu_count(), resize_from=None):
+        '''
+        Decode all of the stimuli into the tensor, rows are written by a pool of processes straight into the file
+
+        @param workers:     number of worker processes
+        @param resize_from: directory with original images, if set they are first resized into DNN/imagesdone
+                            (replaces DNN/resize_images.sh)
+        '''
+        names = StimulusTensor.stimulus_names()
+        try:
+            os.makedirs(StimulusTensor.TENSORDIR)
+        except:
+            pass
+
+        # allocate a temporary file, workers open it again and fill their rows in
+        temporary = RDMStore.temporary_path(StimulusTensor.path())
+        try:
+            tensor = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.uint8,
+                                               shape=(len(names), StimulusTensor.SIZE[0] * StimulusTensor.SIZE[1]))
+            del tensor
+
+            chunk = int(np.ceil(len(names) / float(workers)))
+            jobs = [(temporary, names[start:start + chunk], start, resize_from) for start in range(0, len(names), chunk)]
+            pool = multiprocessing.Pool(workers)
+            pool.map(decode_stimuli, jobs)
+            pool.close()
+            pool.join()
+        except:
+            os.remove(temporary)
+            raise
+
+        RDMStore.atomic_write(StimulusTensor.names_path(), lambda f: np.savetxt(f, names, fmt='%s'), 'w')
+        os.rename(temporary, StimulusTensor.path())
+
+    @staticmethod
+    def load():
+        '''
+        @return: (tensor, names), the tensor is a read-only memory map of [nstim x 51529] uint8 pixels, built first if
+                 it does not exist yet
+        '''
+        if not StimulusTensor.exists():
+            StimulusTensor.build()
+        names = np.loadtxt(StimulusTensor.names_path(), dtype='string', ndmin=1)
+        return np.load(StimulusTensor.path(), mmap_mode='r'), names
+
+
+def decode_stimuli(args):
+    '''
+    Worker of StimulusTensor.build(): decode (and resize) a run of stimuli into rows [start, start + len(names))
+
+    @param args: (path of the tensor being built, names, start, resize_from) tuple
+    '''
+    path, names, start, resize_from = args
+    tensor = np.load(path, mmap_mode='r+')
+    for i, name in enumerate(names):
+        filename = '%s/DNN/imagesdone/%s.jpg' % (StimulusTensor.DATADIR, name)
+        if resize_from is not None:
+            image = Image.open('%s/%s.jpg' % (resize_from, name)).resize(StimulusTensor.SIZE, Image.LANCZOS)
+            image.save(filename, quality=92)
+        image = np.asarray(Image.open(filename))
+        if image.shape != StimulusTensor.SIZE:
+            raise Exception('Stimulus %s is %s, expected a %dx%d grayscale image' % ((name, image.shape) + StimulusTensor.SIZE))
+        tensor[start + i] = np.ravel(image)
+    tensor.flush()
+    del tensor
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Decode stimulus images into one memory-mapped tensor')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, required=False, default=multiprocessing.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-r', '--resize-from', dest='resizefrom', type=str, required=False, help='Directory with original images to resize into DNN/imagesdone first')
+    args = parser.parse_args()
+    workers = int(args.workers)
+    resize_from = str(args.resizefrom) if args.resizefrom is not None else None
+
+    start = time.time()
+    StimulusTensor.build(workers, resize_from)
+    tensor, names = StimulusTensor.load()
+    print 'Decoded %d stimuli into %s (%.1f MB) in %.2fs with %d workers' % (len(names), StimulusTensor.path(),
+                                                                          tensor.nbytes / 1024.0 / 1024.0,
+                                                                          time.time() - start, workers)
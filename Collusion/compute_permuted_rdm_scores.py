@@ -11,6 +11,9 @@ parser.add_argument('-d', '--distance', dest='distance', type=str, required=True
 parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=True, help='image or matrix depending on which you to compute the correlation on')
 parser.add_argument('-t', '--threshold', dest='threshold', type=str, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
 parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Activations of which DNN are to be used')
+parser.add_argument('-r', '--nruns', dest='nruns', type=int, required=False, default=10000, help='Number of permutations')
+parser.add_argument('-m', '--max-memory', dest='maxmemory', type=int, required=False, default=256, help='Memory ceiling in MB for a chunk of permutations, the memory requested for a job is derived from it')
+parser.add_argument('-s', '--sequential', dest='sequential', type=str, required=False, default=False, help='Whether to stop permuting probe-layer pairs once their p-value is known to be above 0.001')
 
 args = parser.parse_args()
 featureset = str(args.featureset)
@@ -18,16 +21,44 @@ distance = str(args.distance)
 onwhat = str(args.onwhat)
 threshold = str(args.threshold)
 network = str(args.network)
+sequential = str(args.sequential) == 'True'
+nruns = int(args.nruns)
+maxmemory = int(args.maxmemory)
 
 DATADIR = '../../Data'
 
+# memory requested for a job in MB: the interpreter with numpy, scipy and sklearn imported (54 MB measured, BASE_MB),
+# the RDMs (RDM_COPIES_LAYER copies of the layer RDMs and RDM_COPIES_PROBE of each brain RDM are alive at most while
+# they are loaded and ranked), the [nprobes x nruns x nlayers] float64 scores with the mask of the sequential test and
+# the chunks under the -m ceiling, plus MARGIN for the allocator and library versions; with 250 stimuli a subject with 6
+# probes peaks at 98 MB with -m 16 and 331 MB with -m 256 for 10000 runs and gets 153 MB and 453 MB
+BASE_MB = 64
+NLAYERS = 9
+RDM_COPIES_LAYER = 6
+RDM_COPIES_PROBE = 4
+MARGIN = 0.25
+
+
+def job_memory(nstim, nprobes):
+    '''
+    @return: memory in MB to request for the job of a subject
+    '''
+    rdms = (RDM_COPIES_LAYER * NLAYERS + RDM_COPIES_PROBE * nprobes) * nstim * nstim * 8
+    scores = nprobes * nruns * NLAYERS * (8 + 1)
+    return int(np.ceil((BASE_MB + (rdms + scores) / 1024.0 / 1024.0 + maxmemory) * (1 + MARGIN)))
+
 subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (DATADIR, featureset)))
 for sid in range(len(subjects)):
     s = sio.loadmat('%s/Intracranial/Processed/%s/%s' % (DATADIR, featureset, subjects[sid]))
-    for pid in range(len(np.ravel(s['s']['probes'][0][0][0][0][3]))):
-        print "echo 'Processing subject %d probe %d'" % (sid, pid)
-        print 'srun --partition=long,phi,main -c 2 --mem=8000 -t 24:00:00 python RDMPermuter.py -i %d -p %d -b rsa -f %s -d %s -o %s -t %s -n %s &' % (sid, pid, featureset, distance, onwhat, threshold, network)
-        print 'sleep 2'
+    nprobes = len(np.ravel(s['s']['probes'][0][0][0][0][3]))
+    nstim = s['s']['data'][0][0].shape[0]
+    if nprobes == 0:
+        continue
+
+    # one job per subject, layer RDMs are loaded and permutations are drawn once for all of its probes
+    print "echo 'Processing subject %d (%d probes)'" % (sid, nprobes)
+    print 'srun --partition=long,phi,main -c 2 --mem=%d -t 24:00:00 python RDMPermuter.py -i %d -a True -b rsa -f %s -d %s -o %s -t %s -n %s -r %d -m %d%s &' % (job_memory(nstim, nprobes), sid, featureset, distance, onwhat, threshold, network, nruns, maxmemory, ' -s True' if sequential else '')
+    print 'sleep 2'
 
 print 'echo "All sent"'
 
@@ -6,6 +6,7 @@ source ~/ve/py27/bin/activate
 
 FEATURESET=$1
 DISTANCE=$2
+WHAT=${3:-all}
 if [ -z "$FEATURESET" ]; then
     echo 'Error: FEATURESET is not specified'
     exit
@@ -15,21 +16,20 @@ if [ -z "$DISTANCE" ]; then
     exit
 fi
 
-# pixels
-srun --partition=long,phi,main -c 1 --mem=2000 -t 96:00:00 python RDM.py -t pixels -d $DISTANCE -f $FEATURESET &
-
-# dnn
-srun --partition=long,phi,main -c 1 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d $DISTANCE -f $FEATURESET -n alexnet &
-srun --partition=long,phi,main -c 1 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d $DISTANCE -f $FEATURESET -n alexnetrandom &
-
-# brain
-nfiles=$(ls -l ../../Data/Intracranial/Processed/$FEATURESET/*.mat | wc -l)
-for i in $(seq 1 $nfiles)
-do
-    let i=i-1
-    srun --partition=long,phi,main -c 1 --mem=2000 -t 96:00:00 python RDM.py -t brain -d $DISTANCE -i $i -f $FEATURESET &
-    sleep 1
-done
+# pixel and dnn RDMs do not depend on the featureset and go to the RDM cache, WHAT=brain skips them when they were
+# computed before (see compute_rdm_matrices_all.sh)
+if [ "$WHAT" != "brain" ]; then
+
+    # pixels
+    srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t pixels -d $DISTANCE -b gram -f $FEATURESET &
+
+    # dnn
+    srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d $DISTANCE -b gram -f $FEATURESET -n alexnet &
+    srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d $DISTANCE -b gram -f $FEATURESET -n alexnetrandom &
+fi
+
+# brain, all subjects in one process pool
+srun --partition=long,phi,main -c 16 --mem=8000 -t 96:00:00 python RDM.py -t brain -d $DISTANCE -a True -w 16 -f $FEATURESET &
 
 echo 'All sent'
 
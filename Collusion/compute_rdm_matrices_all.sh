@@ -1,26 +1,37 @@
 #!/bin/bash
 
+module load python-2.7.11
+source ~/ve/py27/bin/activate
+
+# pixel and dnn RDMs do not depend on the featureset, compute them into the RDM cache once and wait for them, so
+# that the featureset jobs below only compute brain RDMs instead of all missing the cache and computing them again
+FEATURESET=meantheta_LFP_5c_artif_bipolar_BA_w50_theta_resppositive
+srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t pixels -d euclidean -b gram -f $FEATURESET &
+srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d euclidean -b gram -f $FEATURESET -n alexnet &
+srun --partition=long,phi,main -c 8 --mem=2000 -t 96:00:00 python RDM.py -t dnn -d euclidean -b gram -f $FEATURESET -n alexnetrandom &
+wait
+
 # theta
-./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w50_theta_resppositive euclidean & 
-./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w150_theta_resppositive euclidean & 
-./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w250_theta_resppositive euclidean & 
+./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w50_theta_resppositive euclidean brain &
+./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w150_theta_resppositive euclidean brain &
+./compute_rdm_matrices.sh meantheta_LFP_5c_artif_bipolar_BA_w250_theta_resppositive euclidean brain &
 
 # alpha
-./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w50_alpha_resppositive euclidean & 
-./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w150_alpha_resppositive euclidean & 
-./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w250_alpha_resppositive euclidean & 
+./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w50_alpha_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w150_alpha_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanalpha_LFP_5c_artif_bipolar_BA_w250_alpha_resppositive euclidean brain &
 
 # beta
-./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w50_beta_resppositive euclidean & 
-./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w150_beta_resppositive euclidean & 
-./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w250_beta_resppositive euclidean & 
+./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w50_beta_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w150_beta_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanbeta_LFP_5c_artif_bipolar_BA_w250_beta_resppositive euclidean brain &
 
 # low gamma
-./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w50_lowgamma_resppositive euclidean & 
-./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w150_lowgamma_resppositive euclidean & 
-./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w250_lowgamma_resppositive euclidean & 
+./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w50_lowgamma_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w150_lowgamma_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanlowgamma_LFP_5c_artif_bipolar_BA_w250_lowgamma_resppositive euclidean brain &
 
 # high gamma
-./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w50_highgamma_resppositive euclidean & 
-./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w150_highgamma_resppositive euclidean & 
-./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w250_highgamma_resppositive euclidean & 
+./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w50_highgamma_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w150_highgamma_resppositive euclidean brain &
+./compute_rdm_matrices.sh meanhighgamma_LFP_5c_artif_bipolar_BA_w250_highgamma_resppositive euclidean brain &
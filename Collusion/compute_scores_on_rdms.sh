@@ -28,12 +28,7 @@ if [ -z "$NETWORK" ]; then
     exit
 fi
 
-nfiles=$(ls -l ../../Data/Intracranial/Processed/$FEATURESET/*.mat | wc -l)
-for i in $(seq 1 $nfiles)
-do
-    let i=i-1
-    srun --partition=long,phi,main -c 1 --mem=2000 -t 96:00:00 python RSAScorer.py -f $FEATURESET -d $DISTANCE -i $i -o $ONWHAT -t $THRESHOLD -n $NETWORK &
-    sleep 1
-done
+# all subjects in one process, layer RDMs are loaded once
+srun --partition=long,phi,main -c 1 --mem=4000 -t 96:00:00 python RSAScorer.py -f $FEATURESET -d $DISTANCE -a True -c 2048 -o $ONWHAT -t $THRESHOLD -n $NETWORK &
 
 echo 'All sent'
@@ -6,10 +6,11 @@ from sklearn import linear_model
 from sklearn import cross_validation
 from sklearn.decomposition import PCA
 from scipy.stats import spearmanr
-from scipy.ndimage import imread
 import multiprocessing
 from joblib import Parallel, delayed
 import argparse
+from StimulusTensor import StimulusTensor
+from StimulusIndex import StimulusIndex
 
 
 # read in command line arguments
@@ -39,15 +40,16 @@ def scan_alpha(alphas, n_iter, layer_activity_all, probe_responses_all, n_cv):
 
 # train linear model to predict probe [pid] response from [layer]
 # activations, measure the prediction performace on the test set
-# of stimuli
-def predict_from_layer(subject_name, layer, pid, layer_activity_all, probe_responses_all):
+# of stimuli, dnn_rows are the rows of the activations that
+# correspond to the stimuli the subject was shown
+def predict_from_layer(subject_name, layer, pid, activations_all, dnn_rows, probe_responses_all):
 
     # to do artifact rejection we have dropped some number of images from each of the probes
     # now each proble has varying number of "trials" (images), to keep the data in matrix
     # format we inroduce a "poison pill" value of -123456 -- the images with this values as
     # a response should be excluded from further analysis
     keep_stim = probe_responses_all != -123456
-    layer_activity_all = layer_activity_all[keep_stim]
+    layer_activity_all = np.asarray(activations_all[dnn_rows[keep_stim]], dtype=np.float64)
     probe_responses_all = probe_responses_all[keep_stim]
 
     # parameters
@@ -121,17 +123,11 @@ print 'Loading DNN activations...'
 activations = {}
 for layer in layers:
     if layer == 'pixels':
-        activations[layer] = np.zeros((419, 51529))
-        for i, fname in enumerate(sorted(os.listdir('../../Data/DNN/imagesdone/'))):
-            activations[layer][i] = np.ravel(imread('../../Data/DNN/imagesdone/%s' % fname))
+        # memory map of decoded images, rows are in the DNN order like the activations of the other layers
+        activations[layer], _ = StimulusTensor.load()
     else:
         activations[layer] = np.load('../../Repository/DNN/activations/%s/%s/activations.npy' % (np_activation_data, layer))
 
-# load list of stimuli in the order they were presented to DNN
-print 'Loading DNN stimuli...'
-dnn_stimuli = np.loadtxt('../../Data/DNN/imagesdone.txt', dtype={'names': ('stimulus', 'class'), 'formats': ('S10', 'i1')})
-dnn_stimuli = [x[0].split('.')[0] for x in dnn_stimuli]
-
 # read list of subjects
 listing = sorted(os.listdir('../../Data/Intracranial/Processed/%s/' % featureset))
 
@@ -156,15 +152,10 @@ nstims = subject['data'].shape[0]
 nprobes = subject['data'].shape[1]
 
 # create the dataset: for each layer we'll have DNN activations as features
-# and probe response as the target value to predict
-layer_activity = {}
-for layer in layers:
-    layer_activity[layer] = np.zeros((nstims, activations[layer].shape[1]))
-    probe_responses = np.zeros((nstims, nprobes))
-    for sid_brain, stimulus in enumerate(subject['stimseq']):
-        sid_dnn = dnn_stimuli.index(stimulus)
-        layer_activity[layer][sid_brain, :] = activations[layer][sid_dnn, :]
-        probe_responses = subject['data']
+# and probe response as the target value to predict, the activations are
+# not copied, each model takes the rows of the stimuli it uses
+dnn_rows = StimulusIndex.dnn_rows(subject['stimseq'])
+probe_responses = subject['data']
 
 # grid of (subject, layer, pribe) triples to compute in parallel
 parallel_grid = []
@@ -175,7 +166,7 @@ for layer in layers:
 # for each (layer, probe) combination train a linear model to predict the probe response from the layer activations
 start = time.time()
 results = Parallel(n_jobs=ncores, backend="threading")(delayed(predict_from_layer)(subject['name'], layer, pid,
-                                                               layer_activity[layer], probe_responses[:, pid])
+                                                               activations[layer], dnn_rows, probe_responses[:, pid])
                                                        for (layer, pid) in parallel_grid)
 
 # aggregate results and store to files
@@ -0,0 +1,58 @@
+import os
+import argparse
+import numpy as np
+from RSAScorer import RSAScorer
+
+# score all subjects the way RSAScorer.py -a True does, once with the brain RDM cache and once with no cache at all:
+# with the cache each subject's brain RDMs must be loaded once (a miss) and found in the cache (a hit) for every other
+# network, scope and threshold, and the stored scores of both runs must be the same
+parser = argparse.ArgumentParser(description='Check that the brain RDM cache of RSAScorer.score_all_subjects() is hit across networks')
+parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Comma-separated list of featuresets')
+parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric the RDMs were computed with')
+parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Comma-separated list of networks, use at least two to see hits across networks')
+parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=False, default='matrix,image', help='Comma-separated list of scopes')
+parser.add_argument('-t', '--threshold', dest='threshold', type=str, required=False, default='1.0,0.05', help='Comma-separated list of thresholds')
+args = parser.parse_args()
+featuresets = str(args.featureset).split(',')
+distance = str(args.distance)
+networks = str(args.network).split(',')
+scopes = str(args.onwhat).split(',')
+thresholds = [float(t) for t in str(args.threshold).split(',')]
+
+
+def stored_scores():
+    scores = {}
+    for network in networks:
+        for featureset in featuresets:
+            subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset)))
+            for scope in scopes:
+                for threshold in thresholds:
+                    outdir = '%s/Intracranial/Probe_to_Layer_Maps/rsa_%s.%s.%s.%s%s' % (RSAScorer.DATADIR, featureset, distance, network, scope,
+                                                                                      ('%.10f' % threshold)[2:].rstrip('0'))
+                    for subject in subjects:
+                        scores[(network, featureset, scope, threshold, subject)] = np.loadtxt('%s/%s.txt' % (outdir, subject.split('.')[0]))
+    return scores
+
+nsubjects = len(set([RSAScorer.brain_key(featureset, distance, sid)
+                     for featureset in featuresets
+                     for sid in range(len(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset))))]))
+nlookups = sum([len(os.listdir('%s/Intracranial/Processed/%s/' % (RSAScorer.DATADIR, featureset))) for featureset in featuresets]) * \
+    len(networks) * len(scopes) * len(thresholds)
+
+failures = 0
+cache = RSAScorer.score_all_subjects(featuresets, distance, scopes, thresholds, networks)
+cached = stored_scores()
+ok = cache.misses == nsubjects and cache.hits == nlookups - nsubjects
+failures += 0 if ok else 1
+print 'with the cache: %d hits, %d misses of %d lookups (expected %d misses): %s' % (cache.hits, cache.misses, nlookups, nsubjects,
+                                                                                      'ok' if ok else 'FAILED')
+
+cache = RSAScorer.score_all_subjects(featuresets, distance, scopes, thresholds, networks, cache_bytes=0)
+uncached = stored_scores()
+ok = cache.hits == 0 and all([np.array_equal(cached[key], uncached[key]) for key in cached])
+failures += 0 if ok else 1
+print 'without the cache: %d hits, same scores: %s' % (cache.hits, 'ok' if ok else 'FAILED')
+
+if failures > 0:
+    raise Exception('The brain RDM cache is not used as expected')
+print 'The brain RDM cache is hit across networks and does not change the scores'
@@ -0,0 +1,45 @@
+import argparse
+import numpy as np
+from RankCorrelation import RankCorrelation
+
+# check masked scoring on random RDMs against scores() on the kept stimuli, including probes whose masks keep no
+# stimuli, one, two or all of them: those that keep fewer than RankCorrelation.MIN_STIMULI must get NaN scores instead
+# of failing the whole batch
+parser = argparse.ArgumentParser(description='Check RankCorrelation.masked_scores() on random RDMs with degenerate masks')
+parser.add_argument('-s', '--nstim', dest='nstim', type=int, required=False, default=40, help='Number of stimuli')
+parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help='Seed of the random RDMs and masks')
+args = parser.parse_args()
+nstim = int(args.nstim)
+rng = np.random.RandomState(int(args.seed))
+
+
+def random_dsms(n):
+    x = rng.rand(n, nstim, 4)
+    return np.sqrt(np.sum((x[:, :, np.newaxis, :] - x[:, np.newaxis, :, :]) ** 2, axis=3))
+
+layer_dsms = random_dsms(5)
+brain_dsms = random_dsms(6)
+masks = np.ones((6, nstim), dtype=bool)
+masks[0] = False
+masks[1] = np.arange(nstim) == 3
+masks[2] = np.arange(nstim) < 2
+masks[4] = rng.rand(nstim) < 0.7
+
+failures = 0
+for scope in ['matrix', 'image']:
+    for threshold in [1.0, 0.05]:
+        scores = RankCorrelation.masked_scores(layer_dsms, brain_dsms, masks, threshold, scope)
+        for pid in range(len(masks)):
+            keep = np.where(masks[pid])[0]
+            if len(keep) < RankCorrelation.MIN_STIMULI:
+                ok = np.all(np.isnan(scores[pid]))
+            else:
+                expected = RankCorrelation.scores(layer_dsms[:, keep][:, :, keep], brain_dsms[[pid]][:, keep][:, :, keep],
+                                                  threshold, scope)[0]
+                ok = np.allclose(scores[pid], expected, rtol=0.0, atol=1e-12, equal_nan=True)
+            failures += 0 if ok else 1
+            print '%-6s %-4g probe %d keeps %2d stimuli: %s' % (scope, threshold, pid, len(keep), 'ok' if ok else 'FAILED')
+
+if failures > 0:
+    raise Exception('%d masked scores are wrong' % failures)
+print 'All masked scores are correct'
@@ -0,0 +1,56 @@
+import argparse
+import numpy as np
+from RDMPermuter import RDMPermuter
+
+# run the permutations of all probes of a subject under several memory ceilings and check that what the chunks take
+# stays under each of them: the peak resident memory (VmHWM, reset through /proc/self/clear_refs, so Linux only) while
+# permuting, above the resident memory when the first chunk is drawn (layer and brain ranks and the scores array are
+# allocated by then), must not exceed the ceiling
+parser = argparse.ArgumentParser(description='Check that RDMPermuter stays within its memory ceiling')
+parser.add_argument('-i', '--sid', dest='sid', type=int, required=True, help='Subject ID')
+parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use')
+parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Which activations of DNN to use')
+parser.add_argument('-r', '--nruns', dest='nruns', type=int, required=False, default=2000, help='Number of permutations')
+parser.add_argument('-m', '--max-memory', dest='maxmemory', type=str, required=False, default='16,64,256', help='Comma-separated list of memory ceilings in MB')
+parser.add_argument('-s', '--sequential', dest='sequential', type=str, required=False, default=False, help='Whether to run the sequential test (needs the true scores computed by RSAScorer)')
+parser.add_argument('--precision', dest='precision', type=str, required=False, default='float64,float32', help='Comma-separated list of floating point types')
+args = parser.parse_args()
+
+
+def memory_kb(field):
+    for line in open('/proc/self/status'):
+        if line.startswith(field + ':'):
+            return int(line.split()[1])
+
+
+class MeasuredPermuter(RDMPermuter):
+
+    #: Resident memory in MB when the first chunk is drawn, and the number of permutations per chunk
+    baseline = None
+    chunk = None
+
+    def permutations(self, nstim, chunk):
+        open('/proc/self/clear_refs', 'w').write('5')
+        self.baseline = memory_kb('VmRSS') / 1024.0
+        self.chunk = chunk
+        for st, orders in RDMPermuter.permutations(self, nstim, chunk):
+            yield st, orders
+
+failures = 0
+for precision in str(args.precision).split(','):
+    for max_memory in [int(m) for m in str(args.maxmemory).split(',')]:
+        permuter = MeasuredPermuter(int(args.sid), None, 'rsa', str(args.featureset), str(args.distance), '', 'matrix', 1.0,
+                                    str(args.network), False, np.dtype(precision).type, max_memory * 1024 * 1024)
+        permuter.nruns = int(args.nruns)
+        permuter.sequential = bool(args.sequential == 'True')
+        scores = permuter.compute_subject_permutation_scores()
+        used = memory_kb('VmHWM') / 1024.0 - permuter.baseline
+        ok = used <= max_memory
+        failures += 0 if ok else 1
+        print '%s, %d probes, -m %d: %.1f MB over %.1f MB for chunks of %d permutations: %s' % (
+            precision, scores.shape[0], max_memory, used, permuter.baseline, permuter.chunk, 'ok' if ok else 'FAILED')
+
+if failures > 0:
+    raise Exception('%d runs went over their memory ceiling' % failures)
+print 'All runs stayed within their memory ceilings'
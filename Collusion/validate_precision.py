@@ -0,0 +1,91 @@
+import os
+import time
+import argparse
+import numpy as np
+from RDM import RDMPixel, RDMDNN
+from RSAScorer import RSAScorer
+from RDMPermuter import RDMPermuter
+
+
+# compare the float32 pipeline against the float64 one on a featureset: layer RDMs, RSA scores of all of the subjects
+# and permutation p-values of a few probes, nothing is written to the score directories
+parser = argparse.ArgumentParser(description='Compare float32 and float64 RDMs, scores and permutation p-values')
+parser.add_argument('-f', '--featureset', dest='featureset', type=str, required=True, help='Directory with brain features (Processed/?)')
+parser.add_argument('-d', '--distance', dest='distance', type=str, required=True, help='The distance metric to use')
+parser.add_argument('-o', '--onwhat', dest='onwhat', type=str, required=True, help='image or matrix depending on which you to compute the correlation on')
+parser.add_argument('-t', '--threshold', dest='threshold', type=float, required=True, help='Significance level a score must have to be counter (1.0 to store all)')
+parser.add_argument('-n', '--network', dest='network', type=str, required=True, help='Which activations of DNN to use')
+parser.add_argument('-b', '--backend', dest='backend', type=str, required=False, default='pdist', help='How to compute layer RDMs: pdist or gram')
+parser.add_argument('-p', '--probes', dest='probes', type=int, required=False, default=3, help='Number of probes to run the permutation test on')
+parser.add_argument('-r', '--nruns', dest='nruns', type=int, required=False, default=1000, help='Number of permutations per probe')
+parser.add_argument('-s', '--seed', dest='seed', type=int, required=False, default=0, help='Seed of the permutations, same for both precisions')
+args = parser.parse_args()
+featureset = str(args.featureset)
+distance = str(args.distance)
+onwhat = str(args.onwhat)
+threshold = float(args.threshold)
+network = str(args.network)
+backend = str(args.backend)
+nprobes_permuted = int(args.probes)
+nruns = int(args.nruns)
+seed = int(args.seed)
+
+DATADIR = '../../Data'
+precisions = [np.float64, np.float32]
+
+# layer RDMs, float32 ones are cached apart from float64 ones
+print 'Computing layer RDMs...'
+layer_dsms = {}
+for dtype in precisions:
+    start = time.time()
+    pixel_rdm = RDMPixel(distance, featureset, False, backend=backend, dtype=dtype)
+    pixel_rdm.compute_dsm()
+    pixel_rdm.save_dsm()
+    layer_rdm = RDMDNN(distance, network, featureset, False, backend=backend, dtype=dtype)
+    layer_rdm.compute_dsm()
+    layer_rdm.save_dsm()
+    layer_dsms[dtype] = dict([('pixels', pixel_rdm.dsm)] + layer_rdm.dsm.items())
+    print '%s layer RDMs in %.2fs' % (np.dtype(dtype).name, time.time() - start)
+
+for layer in sorted(layer_dsms[np.float64].keys()):
+    exact, reduced = layer_dsms[np.float64][layer], layer_dsms[np.float32][layer]
+    print '%-8s RDM max relative difference %.3e' % (layer, np.max(np.abs(exact - reduced)) / np.max(np.abs(exact)))
+
+# RSA scores of all of the subjects
+print 'Computing scores...'
+subjects = sorted(os.listdir('%s/Intracranial/Processed/%s/' % (DATADIR, featureset)))
+scores = {}
+for dtype in precisions:
+    start = time.time()
+    scores[dtype] = []
+    for sid in range(len(subjects)):
+        rsascorer = RSAScorer(featureset, distance, sid, onwhat, threshold, network, virtual=True, dtype=dtype)
+        scores[dtype].append(rsascorer.compute_all_correlation_scores())
+    print '%s scores in %.2fs' % (np.dtype(dtype).name, time.time() - start)
+
+exact = np.vstack(scores[np.float64]).astype(np.float64)
+reduced = np.vstack(scores[np.float32]).astype(np.float64)
+print 'Scores: max abs difference %.3e, %d of %d probe-layer pairs pass the threshold in both, %d in one only' % (
+    np.max(np.abs(exact - reduced)), np.sum((exact != 0.0) & (reduced != 0.0)), exact.size,
+    np.sum((exact != 0.0) != (reduced != 0.0)))
+
+# permutation p-values of the first few probes
+print 'Running %d permutations on %d probes...' % (nruns, nprobes_permuted)
+pvalues = {}
+for dtype in precisions:
+    pvalues[dtype] = []
+    for sid in range(len(subjects)):
+        for pid in range(scores[np.float64][sid].shape[0]):
+            if len(pvalues[dtype]) == nprobes_permuted:
+                break
+            permuter = RDMPermuter(sid, pid, 'rsa', featureset, distance, '', onwhat, threshold, network, True, dtype)
+            permuter.nruns = nruns
+            np.random.seed(seed)
+            permutation_scores = permuter.compute_permutation_scores()
+            pvalues[dtype].append(np.sum(permutation_scores >= scores[dtype][sid][pid], axis=0) / float(nruns))
+
+exact = np.array(pvalues[np.float64])
+reduced = np.array(pvalues[np.float32])
+if exact.size > 0:
+    print 'P-values: max abs difference %.3e, decisions at 0.001 agree on %d of %d probe-layer pairs' % (
+        np.max(np.abs(exact - reduced)), np.sum((exact <= 0.001) == (reduced <= 0.001)), exact.size)
@@ -32,10 +32,11 @@ with env.begin() as txn:
             arr = caffe.io.datum_to_array(datum)
 
             # lazily initialize matrix, once we know number of features
+            # caffe blobs are float32, storing them as float64 would only double the size
             if data is None:
                 num_features = np.prod(arr.shape)
                 print "Number of features: ", num_features
-                data = np.empty((num_images, num_features))
+                data = np.empty((num_images, num_features), dtype=np.float32)
 
             # copy data to matrix
             data[int(key), ] = arr.reshape(num_features)